@@ -39,12 +39,23 @@ pushd "${PROJECT_REPO}" > /dev/null || exit 1
 
     file_list=${file_list1//$'\n'/ }
   fi
+  # The reviewer picks out the JSON files in FILELIST_JSON_FILE (NUL
+  # separated) and FILELIST_JSON.
+  if [ -n "${FILELIST_JSON_FILE-}" ]; then
+    mapfile -d '' files < "${FILELIST_JSON_FILE}"
+  elif [ -n "${FILELIST_JSON+set}" ]; then
+    read -r -a files <<< "${FILELIST_JSON}"
+  else
+    read -r -a files <<< "${file_list}"
+  fi
 
-  for script_file in ${file_list}; do
+  for script_file in "${files[@]}"; do
 
     if [ -f "${script_file}" ] &&
        [[ ${script_file} == *.json ]]; then
-      if ! jsonlint "${script_file}" | grep -v ': '; then
+      # Drop just the "PATH: ok" lines, the reviewer parses the
+      # "PATH:LINE:COLUMN: Level: message" ones.
+      if ! jsonlint "${script_file}" | grep -v ': ok$'; then
         (( rc=rc+PIPESTATUS[0] ))
       fi
     fi
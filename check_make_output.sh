@@ -32,13 +32,18 @@ if [ ! -e "${MAKE_OUTPUT}" ]; then
   exit 0
 fi
 
-# Only output lines for the files in the review.
+# Only output lines for the files in the review, listed NUL separated in
+# FILELIST_FILE by the reviewer.
+if [ -n "${FILELIST_FILE-}" ]; then
+  exec python3 "$(dirname "${BASH_SOURCE[0]}")"/make_output_filter.py -0 \
+    "${MAKE_OUTPUT}" < "${FILELIST_FILE}"
+fi
 if [ -n "$FILELIST" ]; then
   file_list="$FILELIST"
 else
   pushd "${PROJECT_REPO}" >> /dev/null || exit 1
-    file_list1=$(git "${git_args[@]}")
+    file_list=$(git "${git_args[@]}")
   popd >> /dev/null || exit 1
-  file_list=${file_list1//$'\n'/|}
 fi
-grep -E "${file_list}" "${MAKE_OUTPUT}"
+python3 "$(dirname "${BASH_SOURCE[0]}")"/make_output_filter.py \
+  "${MAKE_OUTPUT}" <<< "${file_list}"
@@ -69,16 +69,6 @@ popd || exit 1
 pylint_rc="$(find "${repo}" -name pylint.rc -print -quit)"
 pylint3_rc="$(find "${repo}" -name pylint3.rc -print -quit)"
 
-pyl_opts=""
-pyl3_opts=""
-
-if [ -n "${pylint_rc}" ]; then
-  pyl_opts=" --rcfile=${pylint_rc}"
-fi
-if [ -n "${pylint3_rc}" ]; then
-  pyl3_opts=" --rcfile=${pylint3_rc}"
-fi
-
 rc=0
 pushd "${PROJECT_REPO}" > /dev/null || exit 1
   if [ -n "$FILELIST" ]; then
@@ -88,38 +78,23 @@ pushd "${PROJECT_REPO}" > /dev/null || exit 1
 
     file_list=${file_list1//$'\n'/ }
   fi
-
-  rm -f "${PYLINT_OUT}"
-
-  tmpl="{path}:{line}: pylint-{symbol}: {msg}"
-
-  pylint="$(command -v pylint)"
-  if [ -z "${pylint}" ]; then
-    echo "pylint not found"
-    exit 1
+  # The reviewer picks out the Python scripts in FILELIST_PYTHON3_FILE
+  # and FILELIST_PYTHON_FILE (NUL separated), or FILELIST_PYTHON3 and
+  # FILELIST_PYTHON.
+  if [ -n "${FILELIST_PYTHON_FILE-}" ]; then
+    mapfile -d '' files < "${FILELIST_PYTHON3_FILE:-/dev/null}"
+    mapfile -d '' -O "${#files[@]}" files < "${FILELIST_PYTHON_FILE}"
+  elif [ -n "${FILELIST_PYTHON+set}" ]; then
+    read -r -a files <<< "${FILELIST_PYTHON3-} ${FILELIST_PYTHON}"
+  else
+    read -r -a files <<< "${file_list}"
   fi
 
-  for script_file in ${file_list}; do
+  rm -f "${PYLINT_OUT}"
 
-    IFS=" " read -r -a pylint_cmd <<< "${pylint} ${pyl_opts} ${script_file}"
-    IFS=" " read -r -a pylint3_cmd <<< "${pylint} ${pyl3_opts} ${script_file}"
-    if file "$script_file" | grep -q -e 'Python script'; then
-      if head -1 "$script_file" | grep -q -e 'python3'; then
-        if ! python3 "${pylint3_cmd[@]}" --msg-template "${tmpl}" >> \
-          "${PYLINT_OUT}" 2>&1; then
-          (( rc=rc+PIPESTATUS[0] ))
-        fi
-      else
-        # Default python, which on current Fedora, etc is same as python3
-        if ! python "${pylint_cmd[@]}" --msg-template "${tmpl}" >> \
-          "${PYLINT_OUT}" 2>&1; then
-          (( rc=rc+PIPESTATUS[0] ))
-        fi
-      fi
-    fi
-  done
-  if [ -e "${PYLINT_OUT}" ]; then
-    grep ':' "${PYLINT_OUT}"
-  fi
+  # Lint the Python scripts in one in-process pylint run per rc file.
+  python3 "$(dirname "${BASH_SOURCE[0]}")"/pylint_batch.py --pylint-rc "${pylint_rc}" \
+    --pylint3-rc "${pylint3_rc}" --output "${PYLINT_OUT}" -- "${files[@]}"
+  rc=$?
 popd > /dev/null || exit 1
 exit ${rc}
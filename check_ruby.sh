@@ -40,11 +40,24 @@ pushd "${PROJECT_REPO}" > /dev/null || exit 1
     file_list=${file_list1//$'\n'/ }
   fi
 
-  for script_file in ${file_list}; do
-    if file "$script_file" | grep -q -e 'Ruby script'; then
-      if ! ruby-lint "${script_file}"; then
-        (( rc=rc+PIPESTATUS[0] ))
+  # The reviewer picks out the Ruby scripts in FILELIST_RUBY_FILE (NUL
+  # separated) and FILELIST_RUBY.
+  if [ -n "${FILELIST_RUBY_FILE-}" ]; then
+    mapfile -d '' script_list < "${FILELIST_RUBY_FILE}"
+  elif [ -n "${FILELIST_RUBY+set}" ]; then
+    read -r -a script_list <<< "${FILELIST_RUBY}"
+  else
+    script_list=()
+    for script_file in ${file_list}; do
+      if file "$script_file" | grep -q -e 'Ruby script'; then
+        script_list+=("${script_file}")
       fi
+    done
+  fi
+
+  for script_file in "${script_list[@]}"; do
+    if ! ruby-lint "${script_file}"; then
+      (( rc=rc+PIPESTATUS[0] ))
     fi
   done
 popd > /dev/null || exit 1
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Check Run Output
+~~~~~ ~~~ ~~~~~~
+
+* Turn the comments of a ReviewInput() into Checks API annotations, with
+  each comment's checker level mapped to an annotation level.
+* Create a check run on the commit under review and stream the
+  annotations to it CHECK_RUN_ANNOTATIONS at a time, the most the Checks
+  API takes in one request, completing it with the last of them.
+
+Unlike the annotations of a review, check run annotations need not be
+on a line of the patch, so nothing is rejected as "Position is invalid"
+or "Path is invalid".
+"""
+
+import datetime
+import logging
+import os
+
+# The name the check run is shown under.
+REVIEW_CHECK_NAME = os.getenv('REVIEW_CHECK_NAME', 'checkpatch')
+
+# The most annotations the Checks API takes in one request.
+CHECK_RUN_ANNOTATIONS = 50
+# GitHub's limits on the text of an annotation and the run's summary.
+ANNOTATION_MESSAGE_MAX = 64*1024
+SUMMARY_MAX = 64*1024
+
+# Checker levels, as the output parsers give them, and the annotation
+# level of each.  Anything else, such as the pylint symbols that
+# check_python.sh gives as levels, is a warning.
+ANNOTATION_LEVELS = {
+    'ERROR': 'failure',
+    'FATAL ERROR': 'failure',
+    'WARNING': 'warning',
+    'NOTE': 'notice',
+    'INFO': 'notice',
+}
+ANNOTATION_LEVEL_ORDER = ('notice', 'warning', 'failure')
+
+
+def annotation_level(levels):
+    """The annotation level of a line with comments at levels"""
+    if not levels:
+        return 'warning'
+    return max((ANNOTATION_LEVELS.get(level.upper(), 'warning')
+                for level in levels), key=ANNOTATION_LEVEL_ORDER.index)
+
+
+def make_annotations(review_input, store=None):
+    """
+    The annotations for the comments of review_input on the paths in
+    review_input['files'], at the levels of the comments in store (the
+    CommentStore review_input was made from), and whether any of them are
+    in the patch.
+    """
+    annotations = []
+    in_patch = False
+    files = review_input.get('files', ())
+    for path, comments in review_input.get('comments', {}).items():
+        if path not in files:
+            continue
+        levels = store.line_levels(path) if store is not None else {}
+        for comment in comments:
+            in_patch = in_patch or comment.get('in-patch', False)
+            line = comment['line']
+            annotations.append({
+                'path': path,
+                'start_line': comment.get('start_line', line),
+                'end_line': line,
+                'annotation_level': annotation_level(levels.get(line)),
+                'message': comment['message'][0:ANNOTATION_MESSAGE_MAX],
+            })
+    return annotations, in_patch
+
+
+def _now():
+    """_"""
+    return datetime.datetime.now(datetime.timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+
+class CheckRun(object):
+    """
+    A check run on head_sha of project/repo, posted through client, a
+    github_api.GithubClient.
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, client, project, repo, head_sha,
+                 name=REVIEW_CHECK_NAME):
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.url = '/repos/{0}/{1}/check-runs'.format(project, repo)
+        self.head_sha = head_sha
+        self.name = name
+        self.run_id = None
+
+    def post(self, title, summary, annotations, conclusion):
+        """
+        Create the check run with the first CHECK_RUN_ANNOTATIONS of
+        annotations and add the rest in as many updates as it takes, the
+        last of which completes it with conclusion.  A run with no more
+        annotations than fit in one request is created completed.
+
+        Returns the number of requests made.  Raises GithubException if
+        one fails, after any retries.
+        """
+        batches = [annotations[start:start + CHECK_RUN_ANNOTATIONS]
+                   for start in range(0, len(annotations),
+                                      CHECK_RUN_ANNOTATIONS)] or [[]]
+        summary = summary[0:SUMMARY_MAX]
+        for number, batch in enumerate(batches, 1):
+            body = {'output': {'title': title, 'summary': summary,
+                               'annotations': batch}}
+            if number == len(batches):
+                body.update(status='completed', conclusion=conclusion,
+                            completed_at=_now())
+            elif number == 1:
+                body['status'] = 'in_progress'
+            if number == 1:
+                body.update(name=self.name, head_sha=self.head_sha)
+                _, data = self.client.send('POST', self.url, body)
+                self.run_id = data['id']
+            else:
+                self.client.send('PATCH', '%s/%s' % (self.url, self.run_id),
+                                 body)
+            self.logger.debug("check run %s: posted %d of %d annotations",
+                              self.run_id, min(number * CHECK_RUN_ANNOTATIONS,
+                                               len(annotations)),
+                              len(annotations))
+        return len(batches)
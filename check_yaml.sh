@@ -39,7 +39,16 @@ pushd "${PROJECT_REPO}" > /dev/null || exit 1
 
     file_list=${file_list1//$'\n'/ }
   fi
-  for script_file in ${file_list}; do
+  # The reviewer picks out the YAML files in FILELIST_YAML_FILE (NUL
+  # separated) and FILELIST_YAML.
+  if [ -n "${FILELIST_YAML_FILE-}" ]; then
+    mapfile -d '' files < "${FILELIST_YAML_FILE}"
+  elif [ -n "${FILELIST_YAML+set}" ]; then
+    read -r -a files <<< "${FILELIST_YAML}"
+  else
+    read -r -a files <<< "${file_list}"
+  fi
+  for script_file in "${files[@]}"; do
 
     if [ -f "${script_file}" ] &&
        [[ ${script_file} == *.yml ]]; then
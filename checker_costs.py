@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Checker Cost Model
+~~~~~~~ ~~~~ ~~~~~
+
+* Record how long each checker took per file, on average, in
+  REVIEW_DURATIONS_PATH, next to REVIEW_HISTORY_PATH by default.
+* Predict from those records how long a checker will take on a set of
+  files, so that the checkers expected to take longest are started
+  first.
+* Predict the makespan of running checkers longest first on a pool of
+  workers, to compare with the actual one.
+
+A checker lints all of its files in one run, so only the time of the
+whole run is known, not that of each file.  Dividing it between the
+files could not tell a slow one from the rest, so only the per checker
+average is kept.  The order only matters when there are fewer
+CHECKPATCH_JOBS than checkers to run.
+"""
+
+import heapq
+import json
+import logging
+import os
+import tempfile
+
+# Where the durations are kept, REVIEW_HISTORY_PATH.durations by default.
+REVIEW_DURATIONS_PATH = os.getenv('REVIEW_DURATIONS_PATH')
+
+# Seconds a checker with no record is expected to take on a file.
+DEFAULT_FILE_SECONDS = 1.0
+# Weight of the latest run in the moving average of each duration.
+ALPHA = 0.5
+
+
+def _average(old, new):
+    """_"""
+    if old is None:
+        return new
+    return old + ALPHA * (new - old)
+
+
+class CheckerCosts(object):
+    """
+    { 'checkers': { CHECKER: { 'file_seconds': SECONDS } } }
+
+    kept in a JSON file between runs.  A checker's run is taken to cost
+    its file_seconds for each of its files.
+    """
+    def __init__(self, path=None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.checkers = {}
+        self.dirty = False
+        if path:
+            try:
+                with open(path, encoding='utf-8') as costs:
+                    self.checkers = {
+                        checker: {'file_seconds': float(
+                            record['file_seconds'])}
+                        for checker, record in
+                        json.load(costs).get('checkers', {}).items()}
+            except (IOError, OSError, ValueError, AttributeError, KeyError,
+                    TypeError):
+                self.checkers = {}
+
+    def file_cost(self, checker):
+        """Predicted seconds for checker to lint a file"""
+        return self.checkers.get(checker, {}).get('file_seconds',
+                                                  DEFAULT_FILE_SECONDS)
+
+    def predict(self, checker, files):
+        """Predicted seconds for checker to lint files"""
+        return self.file_cost(checker) * len(files)
+
+    def record(self, checker, files, seconds):
+        """
+        Record that checker took seconds to lint files.
+        """
+        if not files:
+            return
+        record = self.checkers.setdefault(checker, {})
+        record['file_seconds'] = _average(record.get('file_seconds'),
+                                          seconds / len(files))
+        self.dirty = True
+
+    def save(self):
+        """
+        Atomically write the durations back to their file.
+        """
+        if not self.path or not self.dirty:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as costs:
+                    json.dump({'checkers': self.checkers}, costs)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as excpn:
+            self.logger.debug("checker costs: could not save %s: %s",
+                              self.path, excpn)
+        self.dirty = False
+
+
+def open_costs():
+    """
+    The CheckerCosts in REVIEW_DURATIONS_PATH, or next to
+    REVIEW_HISTORY_PATH.  Without either they only last for this run.
+    """
+    path = REVIEW_DURATIONS_PATH
+    if not path and os.getenv('REVIEW_HISTORY_PATH'):
+        path = os.environ['REVIEW_HISTORY_PATH'] + '.durations'
+    return CheckerCosts(path)
+
+
+def longest_first(costs):
+    """The keys of costs ({ KEY: SECONDS }), the most costly first"""
+    return sorted(costs, key=lambda key: -costs[key])
+
+
+def makespan(costs, workers):
+    """
+    The seconds it takes to run jobs of costs ({ KEY: SECONDS }) longest
+    first on workers, each job starting on the first worker free.
+    """
+    loads = [0.0] * max(min(workers, len(costs)), 1)
+    for key in longest_first(costs):
+        heapq.heapreplace(loads, loads[0] + costs[key])
+    return max(loads)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Checker Output Parsing
+~~~~~~~ ~~~~~~ ~~~~~~~
+
+* Know the output format of each checker and the file types it lints.
+* Parse checkpatch.pl, gcc, pylint, shellcheck, yamllint, jsonlint and
+  ruby-lint output into the comments of a CommentStore, dropping the
+  kinds and files that are ignored.
+
+Kept apart from github_checkpatch, and PyGithub, so that the commit hook
+(staged_lint) starts quickly.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import re
+
+
+def _getenv_list(key, default=None, sep=':'):
+    """
+    'PATH' => ['/bin', '/usr/bin', ...]
+    """
+    value = os.getenv(key)
+    if value is None:
+        return default
+    return value.split(sep)
+
+CHECKPATCH_IGNORED_FILES = _getenv_list('CHECKPATCH_IGNORED_FILES', [
+    'lustre/contrib/wireshark/packet-lustre.c',
+    'lustre/ptlrpc/wiretest.c',
+    'lustre/utils/wiretest.c',
+    '*.patch'])
+CHECKPATCH_IGNORED_KINDS = _getenv_list('CHECKPATCH_IGNORED_KINDS', [
+    'LASSERT',
+    'LCONSOLE',
+    'LEADING_SPACE'])
+
+# gcc, clang and shellcheck --format=gcc:
+# warn_source.c:19:1: warning: control reaches end of non-void
+GCC_RE = re.compile(r'^(?P<path>[^:\s][^:]*):(?P<line>\d+):(?:\d+:)?\s*'
+                    r'(?P<level>fatal error|[A-Za-z]+):\s+(?P<message>.*)$')
+# pylint --msg-template "{path}:{line}: pylint-{symbol}: {msg}":
+# module.py:156: pylint-unused-variable: Unused variable 'idx'
+PYLINT_RE = re.compile(r'^(?P<path>[^:]+):(?P<line>\d+):\s+'
+                       r'(?P<symbol>[^\s:]+):\s+(?P<message>.*)$')
+# yamllint -f parsable:
+# bad_yaml.yml:3:1: [error] too many blank lines (1 > 0) (empty-lines)
+YAMLLINT_RE = re.compile(r'^(?P<path>[^:]+):(?P<line>\d+):\d+:\s+'
+                         r'\[(?P<level>\w+)\]\s+(?P<message>.*)$')
+# ruby-lint:
+# bad_ruby.rb: error: line 2, column 2: undefined method j
+RUBY_LINT_RE = re.compile(r'^(?P<path>[^:]+):\s+(?P<level>\w+):\s+'
+                          r'line (?P<line>\d+), column \d+:\s+'
+                          r'(?P<message>.*)$')
+# checkpatch.pl --show-types, a message line followed by its location:
+# ERROR:CODE_INDENT: code indent should use tabs where possible
+# #404: FILE: lustre/liblustre/dir.c:103:
+CHECKPATCH_MESSAGE_RE = re.compile(r'^(?P<level>ERROR|WARNING):'
+                                   r'(?P<kind>[^:]*):\s*(?P<message>.*)$')
+CHECKPATCH_FILE_RE = re.compile(r'^#\d+: FILE: (?P<path>[^:]+):'
+                                r'(?P<line>\d+):$')
+
+# shellcheck's json1 levels, as shown by --format=gcc
+SHELLCHECK_LEVELS = {'info': 'NOTE', 'style': 'NOTE'}
+
+# Each parser takes an iterable of stripped output lines and yields
+# (PATH, LINE, LEVEL, KIND, TAG, MESSAGE) for each comment found.
+
+def _parse_gcc(lines):
+    """gcc style 'path:line[:column]: level: message' lines"""
+    for line in lines:
+        match = GCC_RE.match(line)
+        if match:
+            yield (match.group('path'), int(match.group('line')),
+                   match.group('level').upper(), 'lint', 'lint',
+                   match.group('message').strip())
+
+def _parse_pylint(lines):
+    """pylint output using the check_python.sh --msg-template"""
+    for line in lines:
+        match = PYLINT_RE.match(line)
+        if match:
+            symbol = match.group('symbol')
+            yield (match.group('path'), int(match.group('line')),
+                   symbol.upper(), 'pylint', symbol,
+                   match.group('message').strip())
+
+def _parse_shellcheck_json1(lines):
+    """shellcheck --format=json1, one document per checked file"""
+    for line in lines:
+        if not line.startswith('{'):
+            # Not JSON, so shellcheck was run with --format=gcc
+            for comment in _parse_gcc([line]):
+                yield comment
+            continue
+        try:
+            comments = json.loads(line).get('comments', [])
+        except ValueError:
+            continue
+        for comment in comments:
+            level = comment.get('level', 'warning')
+            yield (comment['file'], comment['line'],
+                   SHELLCHECK_LEVELS.get(level, level.upper()), 'lint', 'lint',
+                   '{0} [SC{1}]'.format(comment['message'], comment['code']))
+
+def _parse_yamllint(lines):
+    """yamllint -f parsable"""
+    for line in lines:
+        match = YAMLLINT_RE.match(line)
+        if match:
+            yield (match.group('path'), int(match.group('line')),
+                   match.group('level').upper(), 'lint', 'lint',
+                   match.group('message').strip())
+
+def _parse_jsonlint(lines):
+    """jsonlint 'path:line:column: Level: message', skipping 'path: ok'"""
+    for comment in _parse_gcc(lines):
+        yield comment
+
+def _parse_ruby_lint(lines):
+    """ruby-lint"""
+    for line in lines:
+        match = RUBY_LINT_RE.match(line)
+        if match:
+            yield (match.group('path'), int(match.group('line')),
+                   match.group('level').upper(), 'ruby-lint', 'lint',
+                   match.group('message').strip())
+
+def _parse_checkpatch(lines):
+    """checkpatch.pl message and FILE line pairs"""
+    level = kind = message = None
+    for line in lines:
+        if not line:
+            level = kind = message = None
+        elif line[0] == '#':
+            match = CHECKPATCH_FILE_RE.match(line)
+            if match and level:
+                yield (match.group('path').strip(), int(match.group('line')),
+                       level, kind, 'style', message)
+        elif line[0] != '+':
+            match = CHECKPATCH_MESSAGE_RE.match(line)
+            if match and match.group('kind') and match.group('message'):
+                level, kind, message = match.group('level', 'kind', 'message')
+            else:
+                level = kind = message = None
+
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-statements
+def _parse_auto(lines):
+    """
+    Guess the format of each line, for checkers without a declared format.
+    """
+    level = None    # 'ERROR', 'WARNING'
+    kind = None     # 'CODE_INDENT', 'LEADING_SPACE', ...
+    message = None  # 'code indent should use tabs where possible'
+
+    for line in lines:
+        # Checkpatch.pl output:
+        # ERROR:CODE_INDENT: code indent should use tabs where possible
+        # #404: FILE: lustre/liblustre/dir.c:103:
+        # +        op_data.op_hash_offset = hash_x_index(page->index, 0);$
+        # make/gcc/shellcheck output:
+        # warn_source.c:19:1: warning: control reaches end of non-void
+        # bad_yaml.yml:3:1: [error] too many blank lines (1 > 0) (empty-lines)
+        # pylint output:
+        # module.py:156: pylint-unused-variable: Unused variable 'idx'
+        # ruby output:
+        # bad_ruby.rb: error: line 2, column 2: undefined method j
+        if not line:
+            level, kind, message = None, None, None
+        elif line[0] == '#':
+            # '#404: FILE: lustre/liblustre/dir.c:103:'
+            tokens = line.split(':', 5)
+            if len(tokens) != 5 or tokens[1] != ' FILE':
+                continue
+
+            path = tokens[2].strip()
+            line_number_str = tokens[3].strip()
+            if not line_number_str.isdigit():
+                continue
+
+            line_number = int(line_number_str)
+
+            if path and level and kind and message:
+                yield path, line_number, level, kind, 'style', message
+        elif not line[0].isalpha() and line[0] != '.':
+            continue
+        else:
+            if not level:
+                # warn_source.c:19:1: warning: control reaches end of non-void
+                # m.py:156: pylint-unused-variable: Unused variable 'idx'
+                sections = line.count(': ')
+                # Detect pylint output
+                path = None
+                idx = None
+                if sections == 3:
+                    kind = 'ruby-lint'
+                    code = 'lint'
+                    try:
+                        parts = line.split(':', 4)
+                        path = parts[0]
+                        lvl = parts[1].strip().upper()
+                        line_no_str = parts[2].split(',')[0].strip()
+                        lnumber = line_no_str.split(' ', 1)[1].strip()
+                        message = parts[3].strip()
+                    except ValueError:
+                        pass
+                    except IndexError:
+                        try:
+                            # Extra :<sp> in the message part means this is
+                            # actually a GCC/shellcheck mesage
+                            path, lnumber, idx, lvl, message = \
+                                line.split(':', 4)
+                        except ValueError:
+                            try:
+                                path, lnumber, lvl, message = \
+                                    line.split(':', 3)
+                            except ValueError:
+                                pass
+                elif sections == 2:
+                    try:
+                        path, lnumber, idx, lvl, message = line.split(':', 4)
+                    except ValueError:
+                        try:
+                            path, lnumber, lvl, message = line.split(':', 3)
+                        except ValueError:
+                            pass
+                elif sections == 1:
+                    try:
+                        path, lnumber, idx, rest_line = line.split(':', 3)
+                        lvl, message = rest_line.strip().split(' ', 1)
+                    except ValueError:
+                        pass
+                if path is not None:
+                    try:
+                        if idx is None:
+                            kind = 'pylint'
+                            code = lvl.strip()
+                        else:
+                            kind = 'lint'
+                            code = 'lint'
+                        message = message.strip()
+                        level = lvl.strip('[] ').upper()
+                        if lnumber.isdigit() and level and kind:
+                            line_number = int(lnumber)
+                            yield (path, line_number, level, kind, code,
+                                   message)
+                            level = None
+                            continue
+                    except (ValueError, AttributeError):
+                        # Fall back to Checkpatch.pl output
+                        pass
+
+            # ERROR:CODE_INDENT: code indent should use tabs where possible
+            try:
+                level, kind, message = line.split(':', 2)
+            except ValueError:
+                level, kind, message = None, None, None
+
+            if level != 'ERROR' and level != 'WARNING':
+                level, kind, message = None, None, None
+
+OUTPUT_PARSERS = {
+    'auto': _parse_auto,
+    'gcc': _parse_gcc,
+    'pylint': _parse_pylint,
+    'shellcheck-json1': _parse_shellcheck_json1,
+    'yamllint': _parse_yamllint,
+    'jsonlint': _parse_jsonlint,
+    'ruby-lint': _parse_ruby_lint,
+    'checkpatch': _parse_checkpatch,
+}
+
+# The output format of each checker, by file name.  Others are 'auto'.
+# CHECKPATCH_FORMATS can add to or override these as a list of
+# NAME=FORMAT entries, e.g. 'check_local.sh=gcc:check_python.sh=auto'.
+CHECKER_FORMATS = {
+    'check_make_output.sh': 'gcc',
+    'checkpatch.pl': 'checkpatch',
+    'shellcheck_scripts.sh': 'shellcheck-json1',
+    'check_python.sh': 'pylint',
+    'check_yaml.sh': 'yamllint',
+    'check_json.sh': 'jsonlint',
+    'check_ruby.sh': 'ruby-lint',
+}
+CHECKER_FORMATS.update(entry.split('=', 1) for entry in
+                       _getenv_list('CHECKPATCH_FORMATS', []) if '=' in entry)
+
+# The file_types.TYPES each checker lints, by file name.  It is only run
+# if there are files of those types for it.  Others get all of the files.
+CHECKER_FILE_TYPES = {
+    'shellcheck_scripts.sh': ('shell',),
+    'check_python.sh': ('python', 'python3'),
+    'check_yaml.sh': ('yaml',),
+    'check_json.sh': ('json',),
+    'check_ruby.sh': ('ruby',),
+}
+
+# Environment that asks a checker for the format it is parsed as.
+FORMAT_ENV = {
+    'shellcheck-json1': {'SHELLCHECK_FORMAT': 'json1'},
+}
+
+def checker_format(path):
+    """The output format of the checker at path"""
+    fmt = CHECKER_FORMATS.get(os.path.basename(path), 'auto')
+    return fmt if fmt in OUTPUT_PARSERS else 'auto'
+
+def parse_checkpatch_output(out, store, warning_count, files, fmt='auto'):
+    """
+    Parse output out of CHECKPATCH into store, a CommentStore.  out is
+    either a string or an iterable of lines, such as a checker's stdout,
+    which is consumed one line at a time.  fmt names the entry of
+    OUTPUT_PARSERS that understands it.
+    Increment warning_count[0] for each warning not already in store.
+    """
+    # pylint: disable=too-many-arguments
+    def add_comment(path, line, level, kind, tag, message):
+        """_"""
+        in_files = path in files
+        if path.startswith("./"):
+            path = path[2:]
+        logging.debug("add_comment %s %d %s %s '%s'",
+                      path, line, level, kind, message)
+        if kind in CHECKPATCH_IGNORED_KINDS:
+            return
+
+        for pattern in CHECKPATCH_IGNORED_FILES:
+            if fnmatch.fnmatch(path, pattern):
+                return
+
+        message_tag = tag
+        if store.add(path, line, '(%s) %s' % (message_tag, message),
+                     level, kind) and in_files:
+            warning_count[0] += 1
+
+    if isinstance(out, str):
+        out = out.splitlines()
+
+    parser = OUTPUT_PARSERS.get(fmt, _parse_auto)
+    for comment in parser(line.strip() for line in out):
+        add_comment(*comment)
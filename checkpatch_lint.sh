@@ -2,8 +2,18 @@
 
 mydir="$(cd "$(dirname "${BASH_SOURCE[0]}")" >/dev/null 2>&1 && pwd)"
 
-: "${PROJECT_REPO:=$mydir}"
 : "${CODE_REVIEW:=$mydir}"
+# Run as a pre-commit hook (git sets GIT_INDEX_FILE for hooks) lint just
+# what is staged, as it is in the index, in the repository the hook runs
+# in.
+if [ "${1-}" = "--staged" ] ||
+   { [ -z "${GIT_BRANCH-}" ] && [ -n "${GIT_INDEX_FILE-}" ]; }; then
+  exec python3 "$CODE_REVIEW/staged_lint.py" \
+    "$CODE_REVIEW/check_json.sh" "$CODE_REVIEW/check_python.sh" \
+    "$CODE_REVIEW/check_ruby.sh" "$CODE_REVIEW/check_yaml.sh" \
+    "$CODE_REVIEW/shellcheck_scripts.sh"
+fi
+: "${PROJECT_REPO:=$mydir}"
 export PROJECT_REPO
 result=0
 if ! "$CODE_REVIEW/check_json.sh"; then
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Sharded Checkpatch
+~~~~~~~ ~~~~~~~~~~
+
+* Split a patch by file into up to CHECKPATCH_SHARDS shards with about
+  the same number of hunks each, the commit message going to the first,
+  so that checkpatch.pl can check them in parallel.
+* Merge the output of the shards back into what a single run on the
+  whole patch prints: each "#N:" line renumbered to the line of the
+  whole patch, the reports in patch order, a report made once per patch
+  (such as FILE_PATH_CHANGES) once, and one total.
+
+Only checkpatch.pl's default output format is understood, not that of
+--terse or --emacs.
+"""
+
+import array
+import bisect
+import heapq
+import os
+import re
+
+# How many shards to split the patch into for SHARDED_CHECKERS.  1 runs
+# them once on the whole patch.
+CHECKPATCH_SHARDS = int(os.getenv('CHECKPATCH_SHARDS', '1'))
+
+SHARDED_CHECKERS = ('checkpatch.pl',)
+
+FILE_HEADER = b'diff --git '
+HUNK_HEADER = b'\n@@ '
+
+REPORT_LINE_RE = re.compile(r'^#(\d+): ')
+# The index in the total of each level of report.
+TOTAL_LEVELS = {'ERROR': 0, 'WARNING': 1, 'CHECK': 2}
+TOTAL_RE = re.compile(r'^total: (\d+) errors, (\d+) warnings, '
+                      r'(?:(\d+) checks, )?(\d+) lines checked$')
+
+
+class Shard(object):
+    """
+    Some of the segments of a patch, the commit message and the diffs of
+    whole files, in the order they are in the patch, as data.  Segment
+    segments[i] starts on line first_lines[i] of data and line
+    patch_lines[i] of the patch.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('data', 'first_lines', 'patch_lines', 'segments')
+
+    def __init__(self, data, first_lines, patch_lines, segments):
+        self.data = data
+        self.first_lines = first_lines
+        self.patch_lines = patch_lines
+        self.segments = segments
+
+    def original(self, lineno):
+        """(SEGMENT, LINE) of the patch for line lineno of the shard"""
+        index = max(bisect.bisect_right(self.first_lines, lineno) - 1, 0)
+        return (self.segments[index],
+                self.patch_lines[index] + lineno - self.first_lines[index])
+
+
+def _file_starts(data):
+    """The offset of each "diff --git" line of data"""
+    starts = [0] if data.startswith(FILE_HEADER) else []
+    pos = data.find(b'\n' + FILE_HEADER)
+    while pos >= 0:
+        starts.append(pos + 1)
+        pos = data.find(b'\n' + FILE_HEADER, pos + 1)
+    return starts
+
+
+def split_patch(data, shards=None):
+    """
+    Split data, a patch (bytes), between up to shards (CHECKPATCH_SHARDS
+    by default) Shards.  Each file goes to the shard with the fewest hunks
+    so far, the files with the most hunks first.
+
+    Returns a list of one Shard holding all of data for a patch of a
+    single file, or not made by git diff.
+    """
+    # pylint: disable=too-many-locals
+    shards = shards or CHECKPATCH_SHARDS
+    starts = _file_starts(data)
+    if shards < 2 or len(starts) < 2:
+        return [Shard(data, array.array('l', [1]), array.array('l', [1]),
+                      array.array('l', [0]))]
+
+    # (START, END) of each segment, the commit message first if any.
+    bounds = []
+    if starts[0]:
+        bounds.append((0, starts[0]))
+    bounds.extend(zip(starts, starts[1:] + [len(data)]))
+    patch_lines = []
+    lineno = 1
+    previous = 0
+    for start, _ in bounds:
+        lineno += data.count(b'\n', previous, start)
+        previous = start
+        patch_lines.append(lineno)
+
+    shards = min(shards, len(starts))
+    assigned = [[] for _ in range(shards)]
+    first_file = 0
+    if starts[0]:
+        assigned[0].append(0)
+        first_file = 1
+    hunks = {segment: max(data.count(HUNK_HEADER, *bounds[segment]), 1)
+             for segment in range(first_file, len(bounds))}
+    loads = [(0, shard) for shard in range(shards)]
+    for segment in sorted(hunks, key=lambda segment: -hunks[segment]):
+        load, shard = heapq.heappop(loads)
+        assigned[shard].append(segment)
+        heapq.heappush(loads, (load + hunks[segment], shard))
+
+    result = []
+    for segments in assigned:
+        if not segments:
+            continue
+        segments.sort()
+        first_lines = array.array('l')
+        lineno = 1
+        for segment in segments:
+            first_lines.append(lineno)
+            lineno += data.count(b'\n', *bounds[segment])
+        result.append(Shard(b''.join(data[slice(*bounds[segment])]
+                                     for segment in segments),
+                            first_lines,
+                            array.array('l', [patch_lines[segment]
+                                              for segment in segments]),
+                            array.array('l', segments)))
+    return result
+
+
+def merge_output(shards, outputs, returncodes):
+    """
+    Merge outputs, the lines checkpatch.pl printed for each of shards,
+    into the lines it prints for the whole patch.  The text after the
+    total is that of the first shard that found problems (returncodes),
+    or else of the first shard.
+    """
+    # pylint: disable=too-many-locals,too-many-branches
+    reports = []
+    totals = [0, 0, None, 0]
+    trailer = None
+    trailer_returncode = 0
+    for number, (shard, lines, returncode) in enumerate(
+            zip(shards, outputs, returncodes)):
+        block = []
+        segment = shard.segments[0]
+        shard_trailer = None
+        for line in lines:
+            if shard_trailer is not None:
+                shard_trailer.append(line)
+                continue
+            match = TOTAL_RE.match(line.rstrip('\n'))
+            if match:
+                for index, count in enumerate(match.groups()):
+                    if count is not None:
+                        totals[index] = (totals[index] or 0) + int(count)
+                shard_trailer = []
+                continue
+            if not line.strip():
+                if block:
+                    reports.append((segment, len(reports), number,
+                                    block + [line]))
+                    block = []
+                continue
+            match = REPORT_LINE_RE.match(line)
+            if match:
+                segment, lineno = shard.original(int(match.group(1)))
+                line = '#%d: %s' % (lineno, line[match.end():])
+            block.append(line)
+        if block:
+            reports.append((segment, len(reports), number, block))
+        if shard_trailer is not None and \
+           (trailer is None or (returncode and not trailer_returncode)):
+            trailer = shard_trailer
+            trailer_returncode = returncode
+
+    merged = []
+    once = {}
+    for _, _, number, block in sorted(reports):
+        # A report without a FILE: is about the patch as a whole, and
+        # each shard that gets a file it applies to makes it.
+        if len(block) > 1 and REPORT_LINE_RE.match(block[1]) and \
+           ' FILE: ' not in block[1]:
+            if once.setdefault(block[0], number) != number:
+                level = TOTAL_LEVELS.get(block[0].split(':', 1)[0])
+                if level is not None and totals[level]:
+                    totals[level] -= 1
+                continue
+        merged.extend(block)
+    if trailer is not None:
+        merged.append('total: %d errors, %d warnings, %s%d lines checked\n' %
+                      (totals[0], totals[1],
+                       '' if totals[2] is None else '%d checks, ' % totals[2],
+                       totals[3]))
+        merged.extend(trailer)
+    return merged
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Checker Comment Store
+~~~~~~~ ~~~~~~~ ~~~~~
+
+* Hold the comments the checkers make on a patch as (path_id, line,
+  level, kind, msg_id) records in arrays, with each path, level, kind and
+  message text stored once however many records use it.
+* Drop a comment already made on the same line when it is added, so a
+  warning repeated by every compile unit that includes a header is kept
+  once.
+* Give the comments for one path, grouped by line, in the
+  { LINE: [[LEVEL, COMMENT], ...] } form the lint cache, review history
+  and matrix legs keep.
+"""
+
+import array
+
+
+class CommentStore(object):
+    """
+    Distinct (path, line, message) comments, with the level and kind of
+    the first of each, in the order they were added.
+    """
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.path_ids = array.array('L')
+        self.lines = array.array('l')
+        self.levels = array.array('L')
+        self.kinds = array.array('L')
+        self.msg_ids = array.array('L')
+        # Record numbers for each path id, and the (path_id, line, msg_id)
+        # of every record, to find duplicates.
+        self.by_path = {}
+        self.seen = set()
+
+    def _intern(self, string):
+        """The id of string in self.strings, adding it if it is new"""
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def __len__(self):
+        return len(self.msg_ids)
+
+    def __iter__(self):
+        """(PATH, LINE, LEVEL, KIND, COMMENT) for each record"""
+        strings = self.strings
+        for record in range(len(self.msg_ids)):
+            yield (strings[self.path_ids[record]], self.lines[record],
+                   strings[self.levels[record]], strings[self.kinds[record]],
+                   strings[self.msg_ids[record]])
+
+    def add(self, path, line, message, level='', kind=''):
+        """
+        Add message on line of path unless it is already there.
+
+        Returns whether it was added.
+        """
+        path_id = self._intern(path)
+        msg_id = self._intern(message)
+        key = (path_id, line, msg_id)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.by_path.setdefault(path_id, array.array('L')).append(
+            len(self.msg_ids))
+        self.path_ids.append(path_id)
+        self.lines.append(line)
+        self.levels.append(self._intern(level))
+        self.kinds.append(self._intern(kind))
+        self.msg_ids.append(msg_id)
+        return True
+
+    def add_line_comments(self, path, line_comments):
+        """
+        Add { LINE: [[LEVEL, COMMENT], ...] } for path, as kept by the
+        lint cache.
+
+        Returns how many of the comments were added.
+        """
+        added = 0
+        for line, comments in line_comments.items():
+            for level, comment in comments:
+                added += self.add(path, line, comment, level)
+        return added
+
+    def paths(self):
+        """The paths with comments, in the order they were first seen"""
+        strings = self.strings
+        return [strings[path_id] for path_id in self.by_path]
+
+    def path_lines(self, path):
+        """
+        (LINE, [COMMENT, ...]) for each line of path with comments, in the
+        order the lines were first commented on, with the comments in the
+        order they were added.
+        """
+        for line, comments in self._path_records(path).items():
+            yield line, [comment for _, comment in comments]
+
+    def _path_records(self, path):
+        """
+        { LINE: [(LEVEL, COMMENT), ...] } for path, in the order the lines
+        were first commented on.
+        """
+        grouped = {}
+        path_id = self.string_ids.get(path)
+        if path_id is None or path_id not in self.by_path:
+            return grouped
+        strings = self.strings
+        for record in self.by_path[path_id]:
+            grouped.setdefault(self.lines[record], []).append(
+                (strings[self.levels[record]],
+                 strings[self.msg_ids[record]]))
+        return grouped
+
+    def line_levels(self, path):
+        """
+        { LINE: [LEVEL, ...] } for each line of path with comments, with
+        each distinct level given once.
+        """
+        levels = {}
+        path_id = self.string_ids.get(path)
+        if path_id is None or path_id not in self.by_path:
+            return levels
+        strings = self.strings
+        for record in self.by_path[path_id]:
+            level = strings[self.levels[record]]
+            line_levels = levels.setdefault(self.lines[record], [])
+            if level and level not in line_levels:
+                line_levels.append(level)
+        return levels
+
+    def line_comments(self, path):
+        """{ LINE: [[LEVEL, COMMENT], ...] } for path"""
+        return {line: [list(comment) for comment in comments]
+                for line, comments in self._path_records(path).items()}
+
+    def as_dict(self):
+        """{ PATH: { LINE: [[LEVEL, COMMENT], ...] } } for every path"""
+        return {path: self.line_comments(path) for path in self.paths()}
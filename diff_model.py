@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Unified Diff Model
+~~~~~~~ ~~~~ ~~~~~
+
+* Parse a unified diff (git diff or a downloaded pull/N.diff) once, over
+  its raw bytes, into its files and their hunks.
+* Keep each hunk as offsets into the diff and each file's added lines as
+  an array of new line numbers, rather than a string per line.
+* Give the reviewer the paths in the patch, the lines it adds and the
+  text of a hunk, which is only decoded when asked for.
+"""
+
+import array
+import re
+
+HUNK_RE = re.compile(rb'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+DEV_NULL = b'/dev/null'
+
+
+class Hunk(object):
+    """
+    One @@ -old_start,old_count +new_start,new_count @@ hunk, whose lines
+    are data[start:end] of the diff.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('old_start', 'old_count', 'new_start', 'new_count',
+                 'start', 'end')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, old_start, old_count, new_start, new_count, start):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.start = start
+        self.end = start
+
+
+class FileDiff(object):
+    """
+    The changes to one file: its path before (old_path) and after
+    (new_path), either None for /dev/null, its hunks, and the new line
+    numbers of the lines it adds, in order.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('old_path', 'new_path', 'hunks', 'added')
+
+    def __init__(self, old_path):
+        self.old_path = old_path
+        self.new_path = None
+        self.hunks = []
+        self.added = array.array('l')
+
+    @property
+    def path(self):
+        """The path of the file after the change, or before if deleted"""
+        return self.new_path if self.new_path is not None else self.old_path
+
+
+def _header_path(data, start, end):
+    """
+    The path on a --- or +++ line data[start:end], without its a/ or b/
+    prefix, or None for /dev/null.
+    """
+    name = data[start + 4:end].rstrip()
+    if name == DEV_NULL:
+        return None
+    if name.startswith((b'a/', b'b/')):
+        name = name[2:]
+    return name.decode('utf-8', 'replace')
+
+
+class DiffModel(object):
+    """
+    The files and hunks of a unified diff, data (bytes, or a str that is
+    encoded once).
+    """
+    def __init__(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.data = data
+        self.files = []
+        self._parse()
+
+    def _parse(self):
+        """
+        Walk the diff a line at a time by offset.  Inside a hunk only the
+        first byte of a line is looked at, and the hunk ends when its old
+        and new line counts are used up, so a removed line that starts
+        with "-- " is not mistaken for a file header.
+        """
+        # pylint: disable=too-many-locals,too-many-branches
+        data = self.data
+        size = len(data)
+        current = None
+        hunk = None
+        old_left = new_left = 0
+        new_line = 0
+        pos = 0
+        while pos < size:
+            end = data.find(b'\n', pos)
+            if end < 0:
+                end = size
+            if hunk is not None:
+                first = data[pos] if end > pos else 0x20
+                if first == 0x2b:       # '+'
+                    current.added.append(new_line)
+                    new_line += 1
+                    new_left -= 1
+                elif first == 0x2d:     # '-'
+                    old_left -= 1
+                elif first == 0x5c:     # '\', No newline at end of file
+                    pass
+                else:                   # ' ', or a blank context line
+                    new_line += 1
+                    old_left -= 1
+                    new_left -= 1
+                hunk.end = end
+                if old_left <= 0 and new_left <= 0:
+                    hunk = None
+            elif data.startswith(b'@@ ', pos):
+                match = HUNK_RE.match(data, pos, end)
+                if not match:
+                    raise ValueError("error parsing %r" %
+                                     data[pos:end].decode('utf-8', 'replace'))
+                if current is None:
+                    current = FileDiff(None)
+                    self.files.append(current)
+                old_start, old_count, new_start, new_count = match.groups()
+                old_left = int(old_count) if old_count is not None else 1
+                new_left = int(new_count) if new_count is not None else 1
+                new_line = int(new_start)
+                hunk = Hunk(int(old_start), old_left, new_line, new_left,
+                            end + 1)
+                current.hunks.append(hunk)
+                if old_left <= 0 and new_left <= 0:
+                    hunk = None
+            elif data.startswith(b'--- ', pos):
+                current = FileDiff(_header_path(data, pos, end))
+                self.files.append(current)
+            elif data.startswith(b'+++ ', pos) and current is not None:
+                current.new_path = _header_path(data, pos, end)
+            pos = end + 1
+
+    def paths(self):
+        """The set of paths of the files before and after the change"""
+        paths = set()
+        for file_diff in self.files:
+            for path in (file_diff.old_path, file_diff.new_path):
+                if path is not None:
+                    paths.add(path)
+        return paths
+
+    def added_lines(self):
+        """{ PATH: array of the new line numbers of its added lines }"""
+        added = {}
+        for file_diff in self.files:
+            if file_diff.added:
+                added.setdefault(file_diff.path,
+                                 array.array('l')).extend(file_diff.added)
+        return added
+
+    def hunk_lines(self, hunk):
+        """The lines of hunk, decoded, less any "\\ No newline" markers"""
+        if hunk.end <= hunk.start:
+            return []
+        return [line for line in self.data[hunk.start:hunk.end].decode(
+            'utf-8', 'replace').split('\n') if not line.startswith('\\')]
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+File Type Classifier
+~~~~ ~~~~ ~~~~~~~~~~
+
+* Tag each file under review as one of TYPES from its shebang, its
+  extension and the first bytes of its contents, without running file(1).
+* Remember the tag of each file's contents by git blob SHA.
+* Give the checker scripts a FILELIST_<TYPE> list for each type.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+TYPES = ('python', 'python3', 'shell', 'ruby', 'yaml', 'json', 'c')
+
+# How much of a file is read to classify it.
+HEAD_BYTES = 256
+
+EXTENSIONS = {
+    '.py': 'python',
+    '.sh': 'shell',
+    '.bash': 'shell',
+    '.rb': 'ruby',
+    '.yml': 'yaml',
+    '.yaml': 'yaml',
+    '.json': 'json',
+    '.c': 'c',
+    '.h': 'c',
+}
+
+SHELLS = ('sh', 'bash', 'dash', 'ksh', 'mksh', 'zsh')
+
+# Most memo entries kept; the oldest are dropped first.
+MEMO_MAX_ENTRIES = 100000
+
+# The umask, to give the memo that mkstemp() makes 0600 the mode open()
+# would, as it is shared with the lint cache.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def _interpreter(first_line):
+    """
+    The name of the interpreter on a #! line, e.g. 'python3' for both
+    '#!/usr/bin/python3' and '#!/usr/bin/env -S python3 -u'.
+    """
+    words = first_line[2:].decode('utf-8', 'replace').split()
+    if not words:
+        return ''
+    name = os.path.basename(words[0])
+    if name == 'env':
+        for word in words[1:]:
+            if not word.startswith('-') and '=' not in word:
+                return os.path.basename(word)
+        return ''
+    return name
+
+
+def classify(path, head):
+    """
+    The type of path, whose contents start with head, or None if it is
+    not one of TYPES.
+    """
+    # Binary files are never checked, whatever they are called.
+    if b'\0' in head:
+        return None
+    if head.startswith(b'#!'):
+        interpreter = _interpreter(head.split(b'\n', 1)[0])
+        if interpreter.startswith('python3'):
+            return 'python3'
+        if interpreter.startswith('python'):
+            return 'python'
+        if interpreter in SHELLS:
+            return 'shell'
+        if interpreter.startswith('ruby'):
+            return 'ruby'
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+class FileTypes(object):
+    """
+    { BLOB_SHA EXTENSION: TYPE } memo of classify() kept in a JSON file,
+    so files whose blob SHA is known need not be read.
+    """
+    def __init__(self, path=None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.memo = {}
+        self.dirty = False
+        if path:
+            try:
+                with open(path, encoding='utf-8') as memo:
+                    self.memo = json.load(memo)
+            except (IOError, OSError, ValueError):
+                self.memo = {}
+
+    def classify(self, files, repo='.', shas=None):
+        """
+        Classify files, using the memo for those with a blob SHA in shas
+        ({ PATH: SHA }).
+
+        Returns { PATH: TYPE or None }.
+        """
+        shas = shas or {}
+        types = {}
+        for path in files:
+            key = None
+            if path in shas:
+                key = '%s %s' % (shas[path], os.path.splitext(path)[1])
+                if key in self.memo:
+                    types[path] = self.memo[key]
+                    continue
+            try:
+                with open(os.path.join(repo, path), 'rb') as contents:
+                    head = contents.read(HEAD_BYTES)
+            except (IOError, OSError):
+                types[path] = None
+                continue
+            types[path] = classify(path, head)
+            if key:
+                self.memo[key] = types[path]
+                self.dirty = True
+        return types
+
+    def save(self):
+        """
+        Atomically write the memo back to its file.
+        """
+        if not self.path or not self.dirty:
+            return
+        memo = self.memo
+        if len(memo) > MEMO_MAX_ENTRIES:
+            memo = dict(list(memo.items())[-MEMO_MAX_ENTRIES:])
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as out:
+                    json.dump(memo, out)
+                os.chmod(tmp_path, 0o666 & ~UMASK)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as excpn:
+            self.logger.debug("file types: could not save %s: %s",
+                              self.path, excpn)
+        self.dirty = False
+
+
+def file_lists(types, files):
+    """
+    { 'FILELIST_<TYPE>': 'PATH PATH ...' } for each of TYPES, from the
+    files in files, in the same space separated form as FILELIST.
+    """
+    lists = {'FILELIST_' + file_type.upper(): [] for file_type in TYPES}
+    for path in files:
+        if types.get(path):
+            lists['FILELIST_' + types[path].upper()].append(path)
+    return {name: ' '.join(paths) for name, paths in lists.items()}
+
+
+def open_file_types(cache_dir=None):
+    """
+    Return the FileTypes with its memo in cache_dir (the lint cache), or
+    one that only lasts for this run.
+    """
+    if not cache_dir:
+        return FileTypes()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return FileTypes()
+    return FileTypes(os.path.join(cache_dir, 'file_types.json'))
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+GitHub API Access
+~~~~~~ ~~~ ~~~~~~
+
+* Fetch the pull request, commit and reviews the reviewer needs with
+  one request each (per page of reviews).
+* Make the requests for the pull request and its reviews conditional on
+  the ETag of the last response, so repeat runs get 304 Not Modified,
+  which does not count against the rate limit.  A commit looked up by
+  SHA never changes, so is not worth keeping for that.
+* Schedule retries from the rate limit headers GitHub sends, with
+  jittered exponential backoff and an overall deadline for the run.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+
+import github
+from github import GithubException
+
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
+# Seconds the whole run may spend retrying GitHub API calls, and the
+# most attempts made at any one call.
+GITHUB_RETRY_DEADLINE = int(os.getenv('GITHUB_RETRY_DEADLINE', '900'))
+GITHUB_MAX_TRIES = int(os.getenv('GITHUB_MAX_TRIES', '8'))
+
+# Responses worth retrying a GET on.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Most responses kept in the ETag cache; the least recently used go first.
+ETAG_CACHE_MAX_ENTRIES = int(os.getenv('ETAG_CACHE_MAX_ENTRIES', '1000'))
+
+LINK_NEXT_RE = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+# Github instances by login and API URL.  They outlive a reload of this
+# module (as the review daemon does for each job) so that their pooled
+# HTTPS connections are reused from one review to the next.
+try:
+    CONNECTIONS  # pylint: disable=used-before-assignment
+except NameError:
+    CONNECTIONS = {}
+
+
+def connect(login, password, base_url=None):
+    """
+    The github.Github instance for login at base_url (GITHUB_API_URL by
+    default), made on first use.
+    """
+    base_url = base_url or GITHUB_API_URL
+    key = (login, password, base_url)
+    if key not in CONNECTIONS:
+        # https://github.com/PyGithub/PyGithub/issues/693
+        # effectively, GH puts a timeout of 10s on API request processing
+        # but pygithub's default timeout is also 10s so pygithub can close
+        # the socket before GitHub has had a chance to send a 502 response
+        # Retries are left to RetryScheduler rather than the fixed waits
+        # of PyGithub's own (where it has one).
+        try:
+            CONNECTIONS[key] = github.Github(login, password, timeout=15,
+                                             base_url=base_url, retry=None)
+        except TypeError:
+            CONNECTIONS[key] = github.Github(login, password, timeout=15,
+                                             base_url=base_url)
+    return CONNECTIONS[key]
+
+
+def make_object(cls, requester, headers, data):
+    """
+    Build the PyGithub object cls from a response.  Older PyGithub needs
+    completed=True to stop it fetching the object again, newer PyGithub
+    does not take it for objects that can not be completed.
+    """
+    try:
+        return cls(requester, headers, data, completed=True)
+    except TypeError:
+        return cls(requester, headers, data)
+
+
+class RetryScheduler(object):
+    """
+    Decides whether and how long to wait before retrying a GitHub API
+    call, for all of the calls made in a run.
+
+    * A Retry-After header is obeyed as is.
+    * With no requests left (X-RateLimit-Remaining: 0) it waits until
+      X-RateLimit-Reset.
+    * Otherwise it backs off exponentially from base seconds, capped at
+      cap seconds, with full jitter.
+
+    No wait goes past the deadline for the run, and no call is tried more
+    than max_tries times.  slept and retries total the time spent waiting
+    and the number of waits.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, deadline=GITHUB_RETRY_DEADLINE,
+                 max_tries=GITHUB_MAX_TRIES, base=2.0, cap=120.0,
+                 sleep=time.sleep, clock=time.time):
+        self.logger = logging.getLogger(__name__)
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = clock() + deadline
+        self.max_tries = max_tries
+        self.base = base
+        self.cap = cap
+        self.remaining = None
+        self.reset = None
+        self.slept = 0.0
+        self.retries = 0
+
+    def observe(self, headers):
+        """
+        Track the rate limit budget from the headers of a response.
+        """
+        if not headers:
+            return
+        headers = {key.lower(): value for key, value in headers.items()}
+        try:
+            if 'x-ratelimit-remaining' in headers:
+                self.remaining = int(headers['x-ratelimit-remaining'])
+            if 'x-ratelimit-reset' in headers:
+                self.reset = int(headers['x-ratelimit-reset'])
+        except ValueError:
+            pass
+
+    def observe_requester(self, requester):
+        """
+        Track the rate limit budget from the last response PyGithub saw.
+        """
+        try:
+            remaining, _ = requester.rate_limiting
+            self.remaining = remaining
+            self.reset = requester.rate_limiting_resettime
+        except (AttributeError, TypeError, ValueError):
+            pass
+
+    def delay(self, attempt, headers=None):
+        """
+        Seconds to wait before try attempt + 1, given the headers of the
+        response to try attempt.
+        """
+        self.observe(headers)
+        headers = {key.lower(): value
+                   for key, value in (headers or {}).items()}
+        try:
+            return max(float(headers['retry-after']), 0.0)
+        except (KeyError, ValueError):
+            pass
+        if self.remaining == 0 and self.reset:
+            return max(self.reset - self.clock(), 0.0) + 1.0
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def wait(self, attempt, headers=None):
+        """
+        Wait before retrying after try attempt failed.  Returns False
+        without waiting if the call should not be retried.
+        """
+        if attempt >= self.max_tries:
+            return False
+        delay = self.delay(attempt, headers)
+        if self.clock() + delay > self.deadline:
+            self.logger.debug("retry: %.1fs wait would pass the deadline",
+                              delay)
+            return False
+        self.logger.debug("retry: waiting %.1fs before try %d",
+                          delay, attempt + 1)
+        self.sleep(delay)
+        self.slept += delay
+        self.retries += 1
+        return True
+
+    def throttle(self):
+        """
+        Wait for the rate limit to reset if the budget is used up, as far
+        as the deadline allows.
+        """
+        if self.remaining == 0 and self.reset:
+            delay = self.reset - self.clock() + 1.0
+            if delay > 0:
+                delay = min(delay, max(self.deadline - self.clock(), 0.0))
+                self.logger.debug("rate limit used up, waiting %.1fs", delay)
+                self.sleep(delay)
+                self.slept += delay
+            self.remaining = None
+
+
+class ETagCache(object):
+    """
+    { URL: { 'etag': ETAG, 'data': JSON, 'next': URL } } kept in a JSON
+    file between runs, least recently used first, and cut down to
+    max_entries when it is saved.
+    """
+    def __init__(self, path=None, max_entries=ETAG_CACHE_MAX_ENTRIES):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        self.dirty = False
+        if path:
+            try:
+                with open(path, encoding='utf-8') as cache:
+                    self.entries = json.load(cache)
+            except (IOError, OSError, ValueError):
+                self.entries = {}
+
+    def get(self, url):
+        """The entry for url, now the most recently used"""
+        entry = self.entries.pop(url, None)
+        if entry is not None:
+            self.entries[url] = entry
+        return entry
+
+    def put(self, url, etag, data, next_url=None):
+        """_"""
+        self.entries.pop(url, None)
+        self.entries[url] = {'etag': etag, 'data': data, 'next': next_url}
+        self.dirty = True
+
+    def save(self):
+        """
+        Atomically write the cache back to its file.
+        """
+        if not self.path or not self.dirty:
+            return
+        for url in list(self.entries)[:max(len(self.entries) -
+                                           self.max_entries, 0)]:
+            del self.entries[url]
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as cache:
+                    json.dump(self.entries, cache)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as excpn:
+            self.logger.debug("etag cache: could not save %s: %s",
+                              self.path, excpn)
+        self.dirty = False
+
+
+def open_etag_cache():
+    """
+    The ETagCache in GITHUB_ETAG_CACHE, or github_etags.json under
+    REVIEW_HISTORY_BASE.  Without either it only lasts for this run.
+    """
+    path = os.getenv('GITHUB_ETAG_CACHE')
+    if not path and os.getenv('REVIEW_HISTORY_BASE'):
+        path = os.path.join(os.environ['REVIEW_HISTORY_BASE'],
+                            'github_etags.json')
+    return ETagCache(path)
+
+
+class GithubClient(object):
+    """
+    Conditional GETs of the REST endpoints used by the reviewer, made
+    through the Requester of a PyGithub Github instance so that they share
+    its authentication and connection.
+    """
+    def __init__(self, gh_context, cache=None):
+        self.logger = logging.getLogger(__name__)
+        # pylint: disable=protected-access
+        self.requester = gh_context._Github__requester
+        self.cache = cache if cache is not None else ETagCache()
+        self.scheduler = RetryScheduler()
+        self.requests = 0
+        self.not_modified = 0
+        # Requests other than GETs, by method.
+        self.sent = {}
+
+    def get(self, url, parameters=None, conditional=True):
+        """
+        GET url, returning (HEADERS, DATA).  Unless conditional is False,
+        the request is made conditional on the cached response, and a 304
+        response is answered from the cache.
+        """
+        key = url
+        if parameters:
+            key += '?' + '&'.join('%s=%s' % item
+                                  for item in sorted(parameters.items()))
+        entry = self.cache.get(key) if conditional else None
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        attempt = 0
+        while True:
+            attempt += 1
+            self.scheduler.throttle()
+            self.requests += 1
+            status, resp_headers, output = self.requester.requestJson(
+                'GET', url, parameters, headers)
+            self.scheduler.observe(resp_headers)
+            if status not in RETRY_STATUSES or \
+               not self.scheduler.wait(attempt, resp_headers):
+                break
+        if status == 304 and entry:
+            self.not_modified += 1
+            self.logger.debug("GET %s: not modified", key)
+            if entry.get('next'):
+                resp_headers = dict(resp_headers,
+                                    link='<%s>; rel="next"' % entry['next'])
+            return resp_headers, entry['data']
+        data = json.loads(output) if output else None
+        if status >= 400:
+            raise GithubException(status, data, resp_headers)
+        match = LINK_NEXT_RE.search(resp_headers.get('link', ''))
+        if conditional and resp_headers.get('etag'):
+            self.cache.put(key, resp_headers['etag'], data,
+                           match.group(1) if match else None)
+        return resp_headers, data
+
+    def send(self, verb, url, body=None):
+        """
+        Make a verb ('POST', 'PATCH', ...) request of url with the JSON
+        body, retrying server errors and rate limiting as self.scheduler
+        allows, and return (HEADERS, DATA).
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.scheduler.throttle()
+            self.sent[verb] = self.sent.get(verb, 0) + 1
+            status, resp_headers, output = self.requester.requestJson(
+                verb, url, None, None, body)
+            self.scheduler.observe(resp_headers)
+            headers = {key.lower(): value
+                       for key, value in (resp_headers or {}).items()}
+            rate_limited = status in (403, 429) and \
+                ('retry-after' in headers or
+                 headers.get('x-ratelimit-remaining') == '0')
+            if (status not in RETRY_STATUSES and not rate_limited) or \
+               not self.scheduler.wait(attempt, resp_headers):
+                break
+        data = json.loads(output) if output else None
+        if status >= 400:
+            raise GithubException(status, data, resp_headers)
+        return resp_headers, data
+
+    def get_pages(self, url):
+        """
+        GET every page of the list at url.
+        """
+        items = []
+        parameters = {'per_page': 100}
+        while url:
+            headers, data = self.get(url, parameters)
+            items.extend(data or [])
+            match = LINK_NEXT_RE.search(headers.get('link', ''))
+            url = match.group(1) if match else None
+            parameters = None
+        return items
+
+    def get_pull(self, project, repo, number):
+        """The github.PullRequest.PullRequest number of project/repo"""
+        headers, data = self.get('/repos/{0}/{1}/pulls/{2}'.format(
+            project, repo, number))
+        return make_object(github.PullRequest.PullRequest, self.requester,
+                           headers, data)
+
+    def get_commit(self, project, repo, sha):
+        """The github.Commit.Commit sha of project/repo"""
+        # Immutable, and holds the patch of every file, so not cached.
+        headers, data = self.get('/repos/{0}/{1}/commits/{2}'.format(
+            project, repo, sha), conditional=False)
+        return make_object(github.Commit.Commit, self.requester, headers,
+                           data)
+
+    def get_reviews(self, pull_request):
+        """The github.PullRequestReview.PullRequestReview list of a PR"""
+        return [make_object(github.PullRequestReview.PullRequestReview,
+                            self.requester, {}, data)
+                for data in self.get_pages(pull_request.url + '/reviews')]
+
+    def close(self):
+        """Save the ETag cache"""
+        self.cache.save()
@@ -30,21 +30,43 @@ Github Checkpatch Reviewer
 ~~~~~~ ~~~~~~~~~~ ~~~~~~~~
 
 * Run linters on HEAD.
-* POST reviews back to github based on checkpatch output.
+* POST reviews back to github based on checkpatch output, or with
+  REVIEW_SINK=checks a check run (see check_run).
+* With --serve, stay resident and run reviews handed over by later
+  invocations (see review_daemon).
 """
 
-import fnmatch
+import bisect
+import collections
+import concurrent.futures
+import errno
+import json
 import logging
 import os
 import sys
 import subprocess
-import re
-import ssl
+import io
+import signal
+import threading
 import time
+import ssl
 import requests
 import github
-from github import Github
 from github import GithubException
+import check_run
+import checker_output
+import checker_costs
+import checkpatch_shards
+import comment_store
+import diff_model
+import file_types
+import github_api
+import lint_cache
+import metrics
+import patch_stage
+import review_daemon
+import review_history
+import review_matrix
 
 # Monkey-patch in the comfort-fade header.
 def pygithub_create_review2(
@@ -86,8 +108,9 @@ def pygithub_create_review2(
             "POST", self.url + "/reviews", input=post_parameters,
             headers={"Accept": 'application/vnd.github.comfort-fade-preview+json'},
         )
-        return github.PullRequestReview.PullRequestReview(
-            self._requester, headers, data, completed=True
+        return github_api.make_object(
+            github.PullRequestReview.PullRequestReview,
+            self._requester, headers, data
         )
 
 #pylint: disable=too-many-branches
@@ -109,176 +132,50 @@ CHECKPATCH_ARGS = []
 CHECKPATCH_PATHS = _getenv_list('CHECKPATCH_PATHS', ['checkpatch.pl'])
 CHECKPATCH_EXTRA_ARGS = os.getenv('CHECKPATCH_ARGS', '--show-types -').split(' ')
 CHECKPATCH_ARGS.extend(CHECKPATCH_EXTRA_ARGS)
-CHECKPATCH_IGNORED_FILES = _getenv_list('CHECKPATCH_IGNORED_FILES', [
-    'lustre/contrib/wireshark/packet-lustre.c',
-    'lustre/ptlrpc/wiretest.c',
-    'lustre/utils/wiretest.c',
-    '*.patch'])
-CHECKPATCH_IGNORED_KINDS = _getenv_list('CHECKPATCH_IGNORED_KINDS', [
-    'LASSERT',
-    'LCONSOLE',
-    'LEADING_SPACE'])
 STYLE_LINK = os.getenv('STYLE_LINK',
                        'https://wiki.hpdd.intel.com/display/DC/Coding+Rules')
+# How many CHECKPATCH_PATHS may run at once, and how long (in seconds) each
+# one may run before it is killed.  A timeout of 0 means no limit.
+CHECKPATCH_JOBS = int(os.getenv('CHECKPATCH_JOBS', str(os.cpu_count() or 1)))
+CHECKPATCH_TIMEOUT = int(os.getenv('CHECKPATCH_TIMEOUT', '0'))
+# How many times posting a review may fail with a 502 (GitHub timing out
+# on the annotations) before it is posted without them.
+DROP_ANNOTATIONS_AFTER = int(os.getenv('DROP_ANNOTATIONS_AFTER', '2'))
+# REVIEW_BATCH=true posts every annotation, split across as many reviews
+# as it takes to keep each under REVIEW_BATCH_ANNOTATIONS annotations and
+# REVIEW_BATCH_BYTES of JSON, posted one after another.
+REVIEW_BATCH = os.getenv('REVIEW_BATCH', 'false') == 'true'
+REVIEW_BATCH_ANNOTATIONS = int(os.getenv('REVIEW_BATCH_ANNOTATIONS', '31'))
+REVIEW_BATCH_BYTES = int(os.getenv('REVIEW_BATCH_BYTES', str(256*1024)))
+# GitHub's limit on the body of a review.
+REVIEW_BODY_MAX = 64*1024
+# REVIEW_SINK=checks posts the results as a check run, with an annotation
+# for every comment, instead of as a review.  The review is still posted
+# if the check run can not be created, e.g. without a GitHub App token.
+REVIEW_SINK = os.getenv('REVIEW_SINK', 'review')
 
 USE_CODE_REVIEW_SCORE = False
 
-# pylint: disable=too-many-locals
-# pylint: disable=too-many-statements
-def parse_checkpatch_output(out, path_line_comments, warning_count, files):
+def merge_path_line_comments(store, other, warning_count, files):
     """
-    Parse string output out of CHECKPATCH into path_line_comments.
-    Increment warning_count[0] for each warning.
-
-    path_line_comments is { PATH: { LINE: [COMMENT, ...] }, ... }.
+    Add the comments in the CommentStore other to store, incrementing
+    warning_count[0] for each one new to store on a path in files.
     """
-    # pylint: disable=too-many-arguments
-    def add_comment(path, line, level, kind, tag, message, in_files):
-        """_"""
-        if path.startswith("./"):
-            path = path[2:]
-        logging.debug("add_comment %s %d %s %s '%s'",
-                      path, line, level, kind, message)
-        if kind in CHECKPATCH_IGNORED_KINDS:
-            return
-
-        for pattern in CHECKPATCH_IGNORED_FILES:
-            if fnmatch.fnmatch(path, pattern):
-                return
-
-        path_comments = path_line_comments.setdefault(path, {})
-        line_comments = path_comments.setdefault(line, [])
-        message_tag = tag
-        line_comments.append('(%s) %s' % (message_tag, message))
-
-        if in_files:
+    for path, line, level, kind, comment in other:
+        if store.add(path, line, comment, level, kind) and path in files:
             warning_count[0] += 1
 
-    level = None    # 'ERROR', 'WARNING'
-    kind = None     # 'CODE_INDENT', 'LEADING_SPACE', ...
-    message = None  # 'code indent should use tabs where possible'
-
-    for line in out.splitlines():
-        # Checkpatch.pl output:
-        # ERROR:CODE_INDENT: code indent should use tabs where possible
-        # #404: FILE: lustre/liblustre/dir.c:103:
-        # +        op_data.op_hash_offset = hash_x_index(page->index, 0);$
-        # make/gcc/shellcheck output:
-        # warn_source.c:19:1: warning: control reaches end of non-void
-        # bad_yaml.yml:3:1: [error] too many blank lines (1 > 0) (empty-lines)
-        # pylint output:
-        # module.py:156: pylint-unused-variable: Unused variable 'idx'
-        # ruby output:
-        # bad_ruby.rb: error: line 2, column 2: undefined method j
-        line = line.strip()
-        if not line:
-            level, kind, message = None, None, None
-        elif line[0] == '#':
-            # '#404: FILE: lustre/liblustre/dir.c:103:'
-            tokens = line.split(':', 5)
-            if len(tokens) != 5 or tokens[1] != ' FILE':
-                continue
-
-            path = tokens[2].strip()
-            line_number_str = tokens[3].strip()
-            if not line_number_str.isdigit():
-                continue
-
-            line_number = int(line_number_str)
-
-            if path and level and kind and message:
-                add_comment(path, line_number, level, kind, 'style', message, path in files)
-        elif not line[0].isalpha() and line[0] != '.':
-            continue
-        else:
-            if not level:
-                # warn_source.c:19:1: warning: control reaches end of non-void
-                # m.py:156: pylint-unused-variable: Unused variable 'idx'
-                sections = line.count(': ')
-                # Detect pylint output
-                path = None
-                idx = None
-                if sections == 3:
-                    kind = 'ruby-lint'
-                    code = 'lint'
-                    try:
-                        parts = line.split(':', 4)
-                        path = parts[0]
-                        lvl = parts[1].strip().upper()
-                        line_no_str = parts[2].split(',')[0].strip()
-                        lnumber = line_no_str.split(' ', 1)[1].strip()
-                        message = parts[3].strip()
-                    except ValueError:
-                        pass
-                    except IndexError:
-                        try:
-                            # Extra :<sp> in the message part means this is
-                            # actually a GCC/shellcheck mesage
-                            path, lnumber, idx, lvl, message = \
-                                line.split(':', 4)
-                        except ValueError:
-                            try:
-                                path, lnumber, lvl, message = \
-                                    line.split(':', 3)
-                            except ValueError:
-                                pass
-                elif sections == 2:
-                    try:
-                        path, lnumber, idx, lvl, message = line.split(':', 4)
-                    except ValueError:
-                        try:
-                            path, lnumber, lvl, message = line.split(':', 3)
-                        except ValueError:
-                            pass
-                elif sections == 1:
-                    try:
-                        path, lnumber, idx, rest_line = line.split(':', 3)
-                        lvl, message = rest_line.strip().split(' ', 1)
-                    except ValueError:
-                        pass
-                if path is not None:
-                    try:
-                        if idx is None:
-                            kind = 'pylint'
-                            code = lvl.strip()
-                        else:
-                            kind = 'lint'
-                            code = 'lint'
-                        message = message.strip()
-                        level = lvl.strip('[] ').upper()
-                        if lnumber.isdigit() and level and kind:
-                            line_number = int(lnumber)
-                            add_comment(path, line_number, level,
-                                        kind, code, message, path in files)
-                            level = None
-                            continue
-                    except (ValueError, AttributeError):
-                        # Fall back to Checkpatch.pl output
-                        pass
-
-            # ERROR:CODE_INDENT: code indent should use tabs where possible
-            try:
-                level, kind, message = line.split(':', 2)
-            except ValueError:
-                level, kind, message = None, None, None
-
-            if level != 'ERROR' and level != 'WARNING':
-                level, kind, message = None, None, None
-
-
-def review_input_and_score(path_line_comments, warning_count):
+def review_input_and_score(store, warning_count):
     """
-    Convert { PATH: { LINE: [COMMENT, ...] }, ... }, [11] to a
-    ReviewInput() and score
+    Convert a CommentStore, [11] to a ReviewInput() and score
     """
     review_comments = {}
 
-    for path, line_comments in path_line_comments.items():
-        path_comments = []
-        for line, comment_list in line_comments.items():
-            message = '\n'.join(comment_list)
-            path_comments.append({'line': line, 'message': message})
-        review_comments[path] = path_comments
+    for path in store.paths():
+        review_comments[path] = [{'line': line,
+                                  'message': '\n'.join(comment_list)}
+                                 for line, comment_list
+                                 in store.path_lines(path)]
 
     if warning_count[0] > 0:
         score = -1
@@ -299,53 +196,301 @@ def review_input_and_score(path_line_comments, warning_count):
 
 def add_patch_linenos(review_input, patch):
     """
-    Add patch relative line numbers to review_input.
-    """
+    Add patch relative line numbers to review_input.  patch is the
+    patch's text or DiffModel.
 
-    hunknum = None
-    filename = None
-    new_start_line = None
-    src_lineno = None
-    patch_lineno = None
-    for line in patch.split('\n'):
-        if hunknum:
-            patch_lineno += 1
-        if line.startswith("--- a/"):
-            filename = line.rstrip()[6:]
-            continue
-        if line.startswith("+++ /dev/null"):
-            hunknum = 0
-            patch_lineno = 0
-            continue
-        if line.startswith("+++ b/"):
-            filename = line.rstrip()[6:]
-            hunknum = 0
-            patch_lineno = 0
+    The added lines of each file are taken from the diff model and each
+    comment is then looked up in them with a binary search.
+    """
+    if not isinstance(patch, diff_model.DiffModel):
+        patch = diff_model.DiffModel(patch)
+    added_lines = patch.added_lines()
+    for filename, comments in review_input.get('comments', {}).items():
+        lines = added_lines.get(filename)
+        if not lines:
             continue
-        if line.startswith("@@ "):
-            hunknum += 1
-            matches = re.match(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@.*', line)
-            if not matches:
-                print("error parsing ", line)
-                sys.exit(1)
-            new_start_line = matches.group(3)
-            src_lineno = int(new_start_line) - 1
-        if new_start_line:
-            if line.startswith(" ") or \
-               line.startswith("+"):
-                src_lineno += 1
-        if line.startswith("+"):
-            try:
-                for comment in review_input['comments'][filename]:
-                    if comment['line'] == src_lineno:
-                        comment['in-patch'] = True
-                    if 'start_line' in comment:
-                        if src_lineno >= comment['start_line'] and src_lineno <= comment['line']:
-                            comment['in-patch'] = True
-            except KeyError:
-                pass
-        # to debug line mapping
-        #print("{} {} {} {}".format(patch_lineno, filename, src_lineno, line))
+        lines = sorted(lines)
+        for comment in comments:
+            # The comment is in the patch if its line, or any line of its
+            # start_line range, was added.
+            first = comment['line']
+            if 'start_line' in comment:
+                first = min(first, comment['start_line'])
+            idx = bisect.bisect_left(lines, first)
+            if idx < len(lines) and lines[idx] <= comment['line']:
+                comment['in-patch'] = True
+
+def diff_suggestions(diff, comments=None):
+    """
+    Turn each hunk of diff, the git diff -U1 of changes made to the source
+    tree (e.g. by ci/patch_src_in_place) as text or a DiffModel, into a
+    suggestion comment.
+
+    Returns comments, { PATH: [COMMENT, ...] }, with them added.
+    """
+    if comments is None:
+        comments = {}
+
+    def create_comment(lineno, patch_segment):
+        """returns a comment"""
+
+        in_patch = False
+        add_count = 0
+        remove_count = 0
+        new_text = []
+        append_text = []
+        start_line = -1
+        end_line = -1
+        comment = {'include_in_extra': False}
+
+        for line in patch_segment:
+            if line.startswith('+'):
+                add_count += 1
+                if append_text:
+                    new_text.extend(append_text)
+                    lineno += len(append_text)
+                    append_text = []
+                if not in_patch:
+                    in_patch = True
+                    start_line = lineno
+                    append_text = []
+                new_text.append(line[1:])
+                if end_line < lineno:
+                    end_line = lineno
+                lineno += 1
+            elif line.startswith('-'):
+                remove_count += 1
+                if not in_patch:
+                    lineno += len(append_text)
+                    append_text = []
+                    in_patch = True
+                    start_line = lineno
+            else:
+                append_text.append(line[1:])
+        comment['message'] = '```suggestion\n{}\n```'.format('\n'.join(new_text))
+        if start_line == end_line:
+            comment['line'] = start_line
+        else:
+            comment['start_line'] = start_line
+            comment['line'] = end_line
+
+        if remove_count == 1 and add_count == 0:
+            comment['side'] = 'LEFT'
+        else:
+            comment['side'] = 'RIGHT'
+        if 'start_line' in comment:
+            comment['start_side'] = comment['side']
+        return comment
+
+    if not isinstance(diff, diff_model.DiffModel):
+        diff = diff_model.DiffModel(diff)
+    for file_diff in diff.files:
+        for hunk in file_diff.hunks:
+            comments.setdefault(file_diff.path, []).append(
+                create_comment(hunk.old_start, diff.hunk_lines(hunk)))
+    return comments
+
+def split_review_text(text, limit):
+    """
+    Split text into pieces of at most limit characters, at line breaks
+    where possible.
+    """
+    pieces = []
+    piece = ''
+    for line in text.splitlines(True):
+        while len(line) > limit:
+            if piece:
+                pieces.append(piece)
+                piece = ''
+            pieces.append(line[:limit])
+            line = line[limit:]
+        if len(piece) + len(line) > limit:
+            pieces.append(piece)
+            piece = ''
+        piece += line
+    if piece or not pieces:
+        pieces.append(piece)
+    return pieces
+
+def batch_review_comments(comments, max_count, max_bytes):
+    """
+    Split the review comments into lists of at most max_count comments
+    and max_bytes of JSON each.  A comment is never split.
+    """
+    batches = []
+    batch = []
+    size = 0
+    for comment in comments:
+        comment_size = len(json.dumps(comment))
+        if batch and (len(batch) >= max_count or
+                      size + comment_size > max_bytes):
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append(comment)
+        size += comment_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _resolve_target(target, repo='.'):
+    """
+    The commit for the base branch target, preferring the copy fetched
+    from origin, as git_args.sh does.
+    """
+    for ref in ('origin/' + target, target):
+        pipe = subprocess.Popen(['git', 'rev-parse', '--verify', '--quiet',
+                                 ref + '^{commit}'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, cwd=repo)
+        out, _ = pipe.communicate()
+        if pipe.returncode == 0:
+            return out.decode('ascii').strip()
+    raise subprocess.CalledProcessError(128, ['git', 'rev-parse', target])
+
+def git_diff_patch(target, commit, repo='.'):
+    """
+    Compute the pull request patch in the checkout at repo: the diff from
+    the merge-base of the base branch target and commit to commit, which
+    is what GitHub serves as pull/N.diff.
+
+    Returns the patch as bytes, for a DiffModel.
+    """
+    cmd = ['git', 'diff', '--no-color', '--no-ext-diff', '--src-prefix=a/',
+           '--dst-prefix=b/', '{0}...{1}'.format(_resolve_target(target, repo),
+                                                 commit)]
+    pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=repo)
+    patch = pipe.stdout.read()
+    pipe.stdout.close()
+    if pipe.wait():
+        raise subprocess.CalledProcessError(pipe.returncode, cmd)
+    return patch
+
+CheckerResult = collections.namedtuple('CheckerResult',
+                                       'path returncode err timed_out')
+
+# Only the start of a checker's stderr is kept, for debugging.
+CHECKER_STDERR_KEEP = 64 * 1024
+
+def _feed_stdin(pipe, patch):
+    """Write patch to pipe's stdin and close it"""
+    try:
+        pipe.stdin.write(patch)
+    except (BrokenPipeError, ValueError):
+        # The checker does not read its stdin, or was killed.
+        pass
+    finally:
+        try:
+            pipe.stdin.close()
+        except BrokenPipeError:
+            pass
+
+def _drain_stderr(pipe, err):
+    """Read pipe's stderr to EOF, keeping the first CHECKER_STDERR_KEEP bytes"""
+    kept = 0
+    for chunk in iter(lambda: pipe.stderr.read(8192), b''):
+        if kept < CHECKER_STDERR_KEEP:
+            err.append(chunk[:CHECKER_STDERR_KEEP - kept])
+            kept += len(err[-1])
+
+def run_checker(path, patch, env, consume, timeout=None):
+    """
+    Run one of CHECKPATCH_PATHS with patch on stdin and return a
+    CheckerResult holding its exit status and the start of its stderr.
+    patch is either bytes or a file opened on the staged patch, which is
+    then the checker's stdin as it is.
+
+    stdout is passed to consume() as an iterator of lines while the
+    checker is running, so it is never held in memory as a whole.  stdin
+    (when it is a pipe) and stderr are serviced by their own threads so
+    that none of the pipes can fill up and deadlock the checker.
+
+    A checker still running after timeout seconds is killed, along with
+    the rest of its process group.
+    """
+    feed = isinstance(patch, bytes)
+    pipe = subprocess.Popen([path] + CHECKPATCH_ARGS,
+                            stdin=subprocess.PIPE if feed else patch,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            env=env,
+                            start_new_session=True)
+    err = []
+    threads = [threading.Thread(target=_drain_stderr, args=(pipe, err))]
+    if feed:
+        threads.append(threading.Thread(target=_feed_stdin,
+                                        args=(pipe, patch)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    timed_out = threading.Event()
+    def kill():
+        """Kill the checker and anything it started"""
+        timed_out.set()
+        try:
+            os.killpg(pipe.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    stdout = io.TextIOWrapper(pipe.stdout, encoding='utf-8', errors='replace')
+    try:
+        consume(stdout)
+    finally:
+        # Drain anything consume() left so the checker can exit.
+        for _ in iter(lambda: stdout.read(65536), ''):
+            pass
+        stdout.close()
+        pipe.wait()
+        if timer:
+            timer.cancel()
+        for thread in threads:
+            thread.join()
+    return CheckerResult(path, pipe.returncode, b''.join(err),
+                         timed_out.is_set())
+
+def run_checker_sharded(path, shards, env, consume, timeout=None):
+    """
+    Run one of CHECKPATCH_PATHS on each of shards, from
+    checkpatch_shards.split_patch(), at once and pass its output, merged
+    back into that of a single run on the whole patch, to consume().
+
+    Returns a CheckerResult for all of the runs: the first non-zero exit
+    status, the start of their stderr, and whether any timed out.
+    """
+    outputs = [[] for _ in shards]
+
+    def run(index):
+        """_"""
+        return run_checker(path, shards[index].data, env,
+                           outputs[index].extend, timeout)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(shards)) as executor:
+        results = list(executor.map(run, range(len(shards))))
+    returncodes = [result.returncode for result in results]
+    consume(iter(checkpatch_shards.merge_output(shards, outputs,
+                                                returncodes)))
+    return CheckerResult(path,
+                         next((code for code in returncodes if code), 0),
+                         b''.join(result.err for result in results)
+                         [:CHECKER_STDERR_KEEP],
+                         any(result.timed_out for result in results))
+
+def _is_rate_limited(excpn):
+    """
+    Whether a 403 or 429 GithubException is GitHub's (primary or secondary)
+    rate limit rather than a permission problem.
+    """
+    headers = {key.lower(): value for key, value in
+               (getattr(excpn, 'headers', None) or {}).items()}
+    if 'retry-after' in headers or headers.get('x-ratelimit-remaining') == '0':
+        return True
+    message = excpn.data.get('message', '') \
+        if isinstance(excpn.data, dict) else ''
+    return 'rate limit' in message.lower()
 
 class NotPullRequest(Exception):
     ''' An exception to signal that we are not in a PR'''
@@ -362,23 +507,83 @@ class Reviewer(object):
         self.logger = logging.getLogger(__name__)
         self.project, self.repo = os.environ['GIT_URL'].split('/')[-2:]
         self.repo = self.repo[0:-4]
-        # https://github.com/PyGithub/PyGithub/issues/693
-        # effectively, GH puts a timeout of 10s on API request processing but
-        # pygithub's default timeout is also 10s so pygithub can close the
-        # socket before GitHub has had a chance to send a 502 response
-        gh_context = Github(os.environ['GH_USER'], os.environ['GH_PASS'],
-                            timeout=15)
-        repo = gh_context.get_repo("{0}/{1}".format(self.project, self.repo))
-        try:
-            self.pull_request = repo.get_pull(int(os.environ['CHANGE_ID']))
-            if not hasattr(self.pull_request, 'create_review2'):
-                self.pull_request.create_review2 = pygithub_create_review2.__get__(self.pull_request)
-
-        except KeyError:
+        self.metrics = metrics.Metrics({'repo': '%s/%s' % (self.project,
+                                                           self.repo)})
+        gh_context = github_api.connect(os.environ['GH_USER'],
+                                        os.environ['GH_PASS'])
+        # The pull request, commit and reviews are fetched directly rather
+        # than by walking the repo, conditional on their last ETag.
+        self.github = github_api.GithubClient(gh_context,
+                                              github_api.open_etag_cache())
+        if 'CHANGE_ID' not in os.environ:
             raise NotPullRequest
-        self.commits = self.pull_request.get_commits()
         self.patch = None
+        self.diff = None
         self.patch_files = set()
+        # The CommentStore behind the review, for the levels of its
+        # comments.
+        self.store = None
+
+        # Everything the review needs from GitHub is fetched in the
+        # background from the start, while the patch is linted, and
+        # waited for only where it is used.  They are fetched one at a
+        # time: PyGithub's Requester keeps a single connection, which two
+        # requests at once would mix up.  Anything else made through it
+        # waits for the fetches it depends on, the last of them being the
+        # reviews.
+        self.fetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.fetches = {}
+        self._fetch('pull', self._get_pull)
+        if os.getenv('PATCHFILE') is None and \
+           os.getenv('PATCH_SOURCE') == 'http':
+            self._fetch('diff', self._download_patch)
+        if not review_matrix.is_leg() and 'GIT_COMMIT' in os.environ:
+            self._fetch('commit', self.github.get_commit, self.project,
+                        self.repo, os.environ['GIT_COMMIT'])
+            if self._will_post():
+                self._fetch('reviews', self._get_reviews)
+
+    def _fetch(self, key, func, *args):
+        """
+        Start func(*args) in the background the first time key is asked
+        for, and return its future.
+        """
+        if key not in self.fetches:
+            self.fetches[key] = self.fetcher.submit(func, *args)
+        return self.fetches[key]
+
+    def _get_pull(self):
+        """_"""
+        with self.metrics.span('get_pull'):
+            pull_request = self.github.get_pull(self.project, self.repo,
+                                                int(os.environ['CHANGE_ID']))
+        if not hasattr(pull_request, 'create_review2'):
+            pull_request.create_review2 = pygithub_create_review2.__get__(pull_request)
+        return pull_request
+
+    def _get_reviews(self):
+        """_"""
+        with self.metrics.span('get_reviews'):
+            return self.github.get_reviews(self.pull_request)
+
+    @property
+    def pull_request(self):
+        """The pull request, waiting for it to be fetched if need be"""
+        return self._fetch('pull', self._get_pull).result()
+
+    @staticmethod
+    def _will_post():
+        """True if the review is posted rather than only displayed"""
+        # only post if running in Jenkins
+        return 'JENKINS_URL' in os.environ and \
+            os.environ.get('DISPLAY_RESULTS', 'false') == 'false'
+
+    def close(self):
+        """
+        Wait for any fetches still running and save the GitHub ETag cache.
+        """
+        self.fetcher.shutdown(wait=True)
+        self.github.close()
 
     def _debug(self, msg, *args):
         """_"""
@@ -458,150 +663,233 @@ class Reviewer(object):
 
         return score, event, comments, review_comment
 
-    # pylint: disable=too-many-return-statements
+    # pylint: disable=too-many-return-statements,too-many-arguments
+    def _submit_review(self, commit, review_comment, event, comments,
+                       fallback=None):
+        """
+        POST a review, retrying as github_api.RetryScheduler allows.  If
+        it keeps failing with 502s the review is replaced by fallback(),
+        which returns (event, comments, review_comment) without (or with
+        fewer) annotations.
+
+        Returns whether the review was posted.
+        """
+        scheduler = self.github.scheduler
+        tries = 0
+        server_errors = 0
+        force_comment = False
+        while True:
+            tries += 1
+            retry_headers = None
+            try:
+                self._debug("Creating review on try %s" % tries)
+                if server_errors == DROP_ANNOTATIONS_AFTER and fallback:
+                    # the review keeps timing out on GitHub's side, so
+                    # remove all of the annotations to see if it will
+                    # post
+                    event, comments, review_comment = fallback()
+
+                    review_comment += "\n\nNote: Unable to provide any " \
+                                      "annotated comments due to GitHub " \
+                                      "API limitations."
+
+                if force_comment:
+                    event = 'COMMENT'
+
+                scheduler.throttle()
+                self.metrics.count('github_requests', method='POST')
+                res = self.pull_request.create_review2(commit,
+                                                       review_comment,
+                                                       event=event,
+                                                       comments=comments)
+                scheduler.observe_requester(self.github.requester)
+                self._debug("Creating review on try %s complete: %s" % \
+                            (tries, res))
+                print("Successfully posted review after %s tries: %s " % \
+                      (tries, res))
+                return True
+            except ssl.SSLError as excpn:
+                self._debug("Creating review on try %s got an SSLError" % tries)
+                if 'The read operation timed out' not in str(excpn):
+                    print(excpn)
+                    raise
+            except GithubException as excpn:
+                self._debug("Creating review on try %s got a GithubException" % tries)
+                scheduler.observe_requester(self.github.requester)
+                if excpn.status == 422:
+                    if excpn.data['errors'][0] == 'Path is invalid':
+                        print("Tried to sumbit patch comments with a path " \
+                              "that is not in the patch.  Please raise a "\
+                              "ticket about this.")
+                        print("Annotation data:")
+                        import pprint
+                        pprint.PrettyPrinter(indent=4).pprint(comments)
+                        return False
+                    elif excpn.data['errors'][0] == 'Position is invalid':
+                        print("Error parsing the patch and mapping to lines " \
+                              "of code for annotation.  Please raise a "\
+                              "ticket about this.")
+                        print("Annotation data:")
+                        import pprint
+                        pprint.PrettyPrinter(indent=4).pprint(comments)
+                        return False
+                    elif excpn.data['errors'][0] == 'was submitted too quickly':
+                        # rate-limited
+                        self._debug("Attempt to post was rate-limited")
+                        retry_headers = getattr(excpn, 'headers', None)
+                    elif excpn.data['errors'][0] == 'Can not request changes on your own pull request':
+                        force_comment = True
+                        continue
+                    elif excpn.data['errors'][0] == 'Start line must be part of the same hunk as the line.':
+                        print("exception: %s" % excpn)
+                        import pprint
+                        pprint.PrettyPrinter(indent=4).pprint(comments)
+                        return False
+                    else:
+                        print("Unhandled 422 exception:")
+                        print("exception: %s" % excpn)
+                        print("exception.status: %s" % excpn.status)
+                        print("exception.data: %s" % excpn.data)
+                        return False
+                elif excpn.status in (403, 429) and \
+                     _is_rate_limited(excpn):
+                    self._debug("Attempt to post was rate-limited")
+                    retry_headers = getattr(excpn, 'headers', None)
+                elif excpn.status == 502:
+                    if excpn.data['message'] == 'Server Error':
+                        self._debug("Got a 502 Server Error trying to post " \
+                                    "review.  Probably exceeded the 10s API " \
+                                    "time limit.  Will try again.")
+                        server_errors += 1
+                    else:
+                        print("Unhandled 502 exception:")
+                        print("exception: %s" % excpn)
+                        print("exception.status: %s" % excpn.status)
+                        print("exception.data: %s" % excpn.data)
+                        return False
+                else:
+                    raise
+            if not scheduler.wait(tries, retry_headers):
+                break
+            self._debug("Bottom of while loop")
+        self._debug("Exited while loop")
+        self._debug("commit.sha: %s" % commit.sha)
+        self._debug("event: %s" % event)
+        print("Gave up trying to post the review after %s tries" % tries)
+        return False
+
+    def _post_review_batches(self, commit, event, comments, review_comment):
+        """
+        POST review_comment and all of the comments as a review and as many
+        following COMMENT reviews as it takes to keep each one under
+        GitHub's limits.  They are posted in order, one at a time: they
+        share one connection, and GitHub makes reviews on a pull request
+        one at a time anyway.
+        """
+        # leave room for the "continued" header
+        texts = split_review_text(review_comment, REVIEW_BODY_MAX - 200)
+        batches = batch_review_comments(comments, REVIEW_BATCH_ANNOTATIONS,
+                                        REVIEW_BATCH_BYTES)
+        parts = max(len(texts), len(batches), 1)
+        reviews = []
+        for part in range(parts):
+            body = texts[part] if part < len(texts) else ''
+            if part:
+                body = "Style warning(s) continued, part {0} of {1}\n\n" \
+                       "{2}".format(part + 1, parts, body)
+            reviews.append((body, event if part == 0 else 'COMMENT',
+                            batches[part] if part < len(batches) else []))
+
+        def post(review):
+            """Post one review, with its annotations as text if need be"""
+            body, review_event, batch = review
+            def as_text():
+                """_"""
+                text = body
+                for comment in batch:
+                    text += "\n[{0}:{1}](https://github.com/{4}/{5}/blob/" \
+                            "{3}/{0}#L{1}):\n{2}\n".format(
+                                comment['path'], comment['line'],
+                                comment['body'], commit.sha, self.project,
+                                self.repo)
+                return review_event, [], text[0:REVIEW_BODY_MAX-200]
+            return self._submit_review(commit, body, review_event, batch,
+                                       as_text)
+
+        if not post(reviews[0]):
+            return
+        posted = 1 + sum(post(review) for review in reviews[1:])
+        print("Posted {0} of {1} reviews with {2} annotations".format(
+            posted, parts, len(comments)))
+
     def post_review(self, review_input):
         """
         POST review_input for the given revision of change.
         """
 
-        commit = None
-        for commit in self.commits:
-            if commit.sha == os.environ['GIT_COMMIT']:
-                break
+        try:
+            commit = self._fetch('commit', self.github.get_commit,
+                                 self.project, self.repo,
+                                 os.environ['GIT_COMMIT']).result()
+        except GithubException as excpn:
+            self._debug("Looking up commit %s failed: %s",
+                        os.environ['GIT_COMMIT'], excpn)
             commit = None
 
         if not commit:
             print("Couldn't find commit {} in:".format(os.environ['GIT_COMMIT']))
-            for commit in self.commits:
+            for commit in self.pull_request.get_commits():
                 print(commit.sha)
             print("Environment:")
             for k in sorted(os.environ.keys()):
                 print("%s=%s" % (k, os.environ[k]))
             sys.exit(1)
 
-        score, event, comments, review_comment = \
-            self.create_github_review(review_input, commit.sha)
+        if REVIEW_BATCH:
+            # every annotation is posted, in as many reviews as it takes
+            score, event, comments, review_comment = \
+                self.create_github_review(review_input, commit.sha,
+                                          sys.maxsize)
+        else:
+            score, event, comments, review_comment = \
+                self.create_github_review(review_input, commit.sha)
 
-        # only post if running in Jenkins
-        if 'JENKINS_URL' in os.environ and \
-            os.environ.get('DISPLAY_RESULTS', 'false') == 'false':
-            # Github has a comment size limit of 64K, so truncate
-            # we could post multiple comments but at a point where there
-            # 64K of comment, more is probably useless anyway
-            if len(review_comment) > 64*1024:
-                review_comment = review_comment[0:64*1024-80] +           \
-                                 "\n\nThere are more review comments but " \
-                                 "review comment truncated to 64K."
+        if self._will_post():
             # dismiss any previous reviews as they could have been requesting
             # changes and this one could just be a comment (nothing wrong)
-            for review in self.pull_request.get_reviews():
+            for review in self._fetch('reviews', self._get_reviews).result():
                 if review.user and review.user.name and \
                    review.user.name.startswith(os.environ['GH_USER']) and \
                    review.state == "CHANGES_REQUESTED":
+                    self.metrics.count('github_requests', method='PUT')
                     review.dismiss("Updated patch")
 
-            tries = 0
-            max_tries = 4
-            force_comment = False
-            while tries < max_tries:
-                tries += 1
-                try:
-                    self._debug("Creating review on try %s" % tries)
-                    if tries == max_tries -1:
-                        # on the last try remove all of the annotations to see
-                        # if it will post
-                        score, event, comments, review_comment = \
-                            self.create_github_review(review_input, commit.sha, 0)
-
-                        review_comment += "\n\nNote: Unable to provide any " \
-                                          "annotated comments due to GitHub " \
-                                          "API limitations."
-
-                    if force_comment:
-                        event = 'COMMENT'
-
-                    res = self.pull_request.create_review2(commit,
-                                                           review_comment,
-                                                           event=event,
-                                                           comments=comments)
-                    self._debug("Creating review on try %s complete: %s" % \
-                                (tries, res))
-                    print("Successfully posted review after %s tries: %s " % \
-                          (tries, res))
-                    return score
-                except ssl.SSLError as excpn:
-                    self._debug("Creating review on try %s got an SSLError" % tries)
-                    if excpn.message == 'The read operation timed out':
-                        continue
-                    print(excpn)
-                    raise
-                except GithubException as excpn:
-                    self._debug("Creating review on try %s got a GithubException" % tries)
-                    if excpn.status == 422:
-                        if excpn.data['errors'][0] == 'Path is invalid':
-                            print("Tried to sumbit patch comments with a path " \
-                                  "that is not in the patch.  Please raise a "\
-                                  "ticket about this.")
-                            print("Annotation data:")
-                            import pprint
-                            pprint.PrettyPrinter(indent=4).pprint(comments)
-                            return score
-                        elif excpn.data['errors'][0] == 'Position is invalid':
-                            print("Error parsing the patch and mapping to lines " \
-                                  "of code for annotation.  Please raise a "\
-                                  "ticket about this.")
-                            print("Annotation data:")
-                            import pprint
-                            pprint.PrettyPrinter(indent=4).pprint(comments)
-                            return score
-                        elif excpn.data['errors'][0] == 'was submitted too quickly':
-                            # rate-limited
-                            #import pprint
-                            self._debug("Attempt to post was rate-limited")
-                            if tries < max_tries + 1:
-                                self._debug("Trying again in 60 seconds")
-                                time.sleep(60)
-                                self._debug("Done sleeping 422")
-                            else:
-                                self._debug("commit.sha: %s" % commit.sha)
-                                self._debug("review_comment: %s" % review_comment)
-                                self._debug("event: %s" % event)
-                                self._debug("comments:")
-                                #pprint.PrettyPrinter(indent=4).pprint(comments)
-                                self._debug("Attempt to post was rate-limited. " \
-                                            "See data above.")
-                                return score
-                        elif excpn.data['errors'][0] == 'Can not request changes on your own pull request':
-                            force_comment = True
-                        elif excpn.data['errors'][0] == 'Start line must be part of the same hunk as the line.':
-                            print("exception: %s" % excpn)
-                            import pprint
-                            pprint.PrettyPrinter(indent=4).pprint(comments)
-                            return score
-                        else:
-                            print("Unhandled 422 exception:")
-                            print("exception: %s" % excpn)
-                            print("exception.status: %s" % excpn.status)
-                            print("exception.data: %s" % excpn.data)
-                            return score
-                    elif excpn.status == 502:
-                        if excpn.data['message'] == 'Server Error':
-                            self._debug("Got a 502 Server Error trying to post " \
-                                        "review.  Probably exceeded the 10s API " \
-                                        "time limit.  Will try again.")
-                            time.sleep(5)
-                            self._debug("Done sleeping 502")
-                        else:
-                            print("Unhandled 502 exception:")
-                            print("exception: %s" % excpn)
-                            print("exception.status: %s" % excpn.status)
-                            print("exception.data: %s" % excpn.data)
-                            return score
-                    else:
-                        raise
-                self._debug("Bottom of while loop")
-            self._debug("Exited while loop")
-            print("Gave up trying to post the review after %s tries" % tries)
+            if REVIEW_SINK == 'checks' and \
+               self._post_check_run(review_input, commit, score):
+                return score
+
+            if REVIEW_BATCH:
+                self._post_review_batches(commit, event, comments,
+                                          review_comment)
+                return score
+
+            # Github has a comment size limit of 64K, so truncate
+            # we could post multiple comments but at a point where there
+            # 64K of comment, more is probably useless anyway
+            if len(review_comment) > REVIEW_BODY_MAX:
+                review_comment = review_comment[0:REVIEW_BODY_MAX-80] +     \
+                                 "\n\nThere are more review comments but " \
+                                 "review comment truncated to 64K."
+
+            def without_annotations():
+                """All of the errors as review text"""
+                _, fallback_event, fallback_comments, fallback_comment = \
+                    self.create_github_review(review_input, commit.sha, 0)
+                return fallback_event, fallback_comments, \
+                    fallback_comment[0:REVIEW_BODY_MAX-200]
+
+            self._submit_review(commit, review_comment, event, comments,
+                                without_annotations)
             return score
         else:
             import pprint
@@ -611,67 +899,320 @@ class Reviewer(object):
             print("event:", event)
             print("comments (%s):\n" % len(comments))
             pprinter.pprint(comments)
+            if REVIEW_SINK == 'checks':
+                annotations, _ = check_run.make_annotations(review_input,
+                                                            self.store)
+                print("check run annotations (%s):\n" % len(annotations))
+                pprinter.pprint(annotations)
 
         return score
 
+    def _post_check_run(self, review_input, commit, score):
+        """
+        Post review_input as a check run on commit, with a conclusion of
+        failure for a score below 0, else neutral if there are any
+        annotations at all, else success.
+
+        Returns whether the check run was created.
+        """
+        annotations, _ = check_run.make_annotations(review_input, self.store)
+        if score < 0:
+            conclusion = 'failure'
+        elif annotations:
+            conclusion = 'neutral'
+        else:
+            conclusion = 'success'
+        summary = review_input.get('message') or \
+            "LGTM.  No errors found by checkpatch."
+        title = "%d style warning(s)" % len(annotations) if annotations \
+            else "No style warnings"
+        run = check_run.CheckRun(self.github, self.project, self.repo,
+                                 commit.sha)
+        try:
+            posts = run.post(title, summary, annotations, conclusion)
+        except GithubException as excpn:
+            if run.run_id is None:
+                print("Could not create a check run, posting a review "
+                      "instead: %s" % excpn)
+                return False
+            print("Could not add all of the annotations to check run %s: "
+                  "%s" % (run.run_id, excpn))
+            return True
+        print("Posted check run %s with %d annotations in %d requests" %
+              (run.run_id, len(annotations), posts))
+        return True
+
     def check_patch(self, patch, files):
         """
-        Run each script in CHECKPATCH_PATHS on patch, return a
+        Run each script in CHECKPATCH_PATHS on patch (bytes), return a
         ReviewInput() and score.
         """
-        path_line_comments = {}
+        store = comment_store.CommentStore()
         warning_count = [0]
         my_env = os.environ
         my_env['FILELIST'] = ' '.join(files)
         self._debug("checking files: %s" % my_env['FILELIST'])
 
-        for path in CHECKPATCH_PATHS:
+        # Per file results of the cacheable checkers are carried forward
+        # from the last reviewed revision for files that have not changed
+        # since, or else looked up by blob SHA.  Only the files left over
+        # are passed to the checker.
+        cache = lint_cache.open_cache(
+            os.getenv('PROJECT_REPO', '.'), CHECKPATCH_ARGS,
+            checker_output.CHECKPATCH_IGNORED_KINDS +
+            checker_output.CHECKPATCH_IGNORED_FILES)
+        config_keys = {}
+        if cache:
+            config_keys = {path: cache.config_key(path)
+                           for path in CHECKPATCH_PATHS
+                           if cache.cacheable(path)}
+        history = review_history.open_history() if cache else None
+        change_id = os.getenv('CHANGE_ID')
+        commit = os.getenv('GIT_COMMIT')
+        carried = {}
+        if history and change_id and commit:
+            carried = history.carry_forward(change_id, commit, files,
+                                            config_keys, cache.repo)
+        checker_results = {path: dict(carried.get(path, {}))
+                           for path in config_keys}
+        shas = {}
+        if cache:
+            shas = lint_cache.blob_shas(
+                [filename for filename in files
+                 if any(filename not in checker_results[path]
+                        for path in config_keys)], cache.repo)
+        # Each checker is only given the files of the types it lints.
+        types_memo = file_types.open_file_types(cache.path if cache else None)
+        types = types_memo.classify(files, os.getenv('PROJECT_REPO', '.'),
+                                    shas)
+        types_memo.save()
+        checker_files = {}
+        for path in config_keys:
+            wanted = checker_output.CHECKER_FILE_TYPES.get(
+                os.path.basename(path))
+            misses = []
+            for filename in sorted(files):
+                if filename in checker_results[path]:
+                    continue
+                if wanted and types.get(filename) not in wanted:
+                    checker_results[path][filename] = {}
+                    continue
+                line_comments = None
+                if filename in shas:
+                    line_comments = cache.get(cache.key(path, shas[filename]))
+                if line_comments is None:
+                    misses.append(filename)
+                else:
+                    checker_results[path][filename] = line_comments
+            checker_files[path] = misses
+        if cache:
+            self._debug("lint cache: %d carried forward, %d hits, %d misses",
+                        sum(len(results) for results in carried.values()),
+                        cache.hits, cache.misses)
+
+        # Run the checkers concurrently, each parsing its output into its
+        # own comments as it is produced.  The comments are then merged in
+        # CHECKPATCH_PATHS order so the review does not depend on which
+        # checker finishes first.
+        def check(path, env):
+            """Run and parse a single checker"""
+            checker_comments = comment_store.CommentStore()
+            name = os.path.basename(path)
+            def consume(lines):
+                """_"""
+                def counted():
+                    """Count the output, decoded, as it is parsed"""
+                    size = 0
+                    try:
+                        for line in lines:
+                            size += len(line)
+                            yield line
+                    finally:
+                        self.metrics.count('checker_output_bytes', size,
+                                           checker=name)
+                checker_output.parse_checkpatch_output(
+                    counted(), checker_comments, [0], files,
+                    checker_output.checker_format(path))
+            start = time.monotonic()
+            with self.metrics.span('checker', checker=name):
+                if len(shards) > 1 and \
+                   name in checkpatch_shards.SHARDED_CHECKERS:
+                    result = run_checker_sharded(path, shards, env, consume,
+                                                 CHECKPATCH_TIMEOUT or None)
+                else:
+                    with stage.open_patch() as stdin:
+                        result = run_checker(path, stdin, env, consume,
+                                             CHECKPATCH_TIMEOUT or None)
+            timings[path] = (start, time.monotonic())
+            return result, checker_comments
+
+        # checkpatch.pl is run on the patch split by file, in parallel,
+        # when CHECKPATCH_SHARDS is more than 1.
+        shards = []
+        if any(os.path.basename(path) in checkpatch_shards.SHARDED_CHECKERS
+               for path in CHECKPATCH_PATHS):
+            shards = checkpatch_shards.split_patch(patch)
+            self.metrics.count('checkpatch_shards', len(shards))
+
+        costs = checker_costs.open_costs()
+        timings = {}
+
+        # The patch and file lists are staged once for all of the checkers.
+        self.metrics.count('patch_bytes', len(patch))
+        with patch_stage.PatchStage(patch) as stage, \
+             concurrent.futures.ThreadPoolExecutor(
+                 max_workers=max(CHECKPATCH_JOBS, 1)) as executor:
+            # A checker is not started at all when none of the files are
+            # for it, and the rest are started longest first, as predicted
+            # from how long they took on the same files before.
+            jobs = {}
+            for path in CHECKPATCH_PATHS:
+                name = os.path.basename(path)
+                filelist = checker_files.get(path, files)
+                wanted = checker_output.CHECKER_FILE_TYPES.get(name)
+                lint_files = [filename for filename in filelist
+                              if not wanted or types.get(filename) in wanted]
+                if not lint_files:
+                    self.metrics.count('checkers_skipped', checker=name)
+                    continue
+                env = dict(my_env, **checker_output.FORMAT_ENV.get(
+                    checker_output.checker_format(path), {}))
+                env['FILELIST'] = ' '.join(filelist)
+                env.update(file_types.file_lists(types, filelist))
+                env.update(stage.env(filelist, types))
+                jobs[path] = (env, lint_files)
+            predicted = {path: costs.predict(os.path.basename(path),
+                                             jobs[path][1])
+                         for path in jobs}
+            started = time.monotonic()
+            futures = {path: executor.submit(check, path, jobs[path][0])
+                       for path in checker_costs.longest_first(predicted)}
+            for path in CHECKPATCH_PATHS:
+                future = futures.get(path)
+                checker_comments = comment_store.CommentStore()
+                if future is not None:
+                    try:
+                        result, checker_comments = future.result()
+                    except OSError as exception:
+                        if exception.errno == errno.ENOENT:
+                            print("Could not find {0}".format(path))
+                            sys.exit(1)
+                        raise
+                    if result.timed_out:
+                        self._error("check_patch: %s timed out after %d "
+                                    "seconds", path, CHECKPATCH_TIMEOUT)
+                    self._debug("check_patch: path = %s %s, rc = %s, "
+                                "err = '%s...'", path, CHECKPATCH_ARGS,
+                                result.returncode, result.err[:80])
+                    if path in checker_files:
+                        if result.timed_out:
+                            # Incomplete, so neither cache nor record it.
+                            del config_keys[path]
+                        else:
+                            for filename in checker_files[path]:
+                                line_comments = \
+                                    checker_comments.line_comments(filename)
+                                checker_results[path][filename] = line_comments
+                                if filename in shas:
+                                    cache.put(cache.key(path, shas[filename]),
+                                              line_comments)
+                for filename in sorted(checker_results.get(path, {})):
+                    if filename not in checker_files.get(path, []):
+                        checker_comments.add_line_comments(
+                            filename, checker_results[path][filename])
+                merge_path_line_comments(store, checker_comments,
+                                         warning_count, files)
+        self._report_schedule(costs, jobs, predicted, timings, started)
+        if cache:
+            cache.evict()
+        # A run with no results to record (e.g. a matrix leg that ran no
+        # checkers) leaves the last record as it was.
+        if history and change_id and commit and config_keys:
+            history.record(change_id, commit,
+                           {config_keys[path]: checker_results[path]
+                            for path in config_keys})
+        if review_matrix.is_leg():
             try:
-                pipe = subprocess.Popen([path] + CHECKPATCH_ARGS,
-                                        stdin=subprocess.PIPE,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        env=my_env)
-            except OSError as exception:
-                if exception.errno == 2:
-                    print("Could not find {0}".format(path))
-                    sys.exit(1)
-
-            out, err = pipe.communicate(patch.encode('utf-8'))
-            self._debug("check_patch: path = %s %s, out = '%s...', err = '%s...'",
-                        path, CHECKPATCH_ARGS, out[:80], err[:80])
-            parse_checkpatch_output(out.decode('utf-8'), path_line_comments, warning_count, files)
-
-        return review_input_and_score(path_line_comments, warning_count)
+                review_matrix.write_leg(store, commit)
+            except (IOError, OSError) as excpn:
+                print("Could not save the results of matrix leg %s: %s" %
+                      (review_matrix.REVIEW_MATRIX_LEG, excpn))
+                sys.exit(1)
+
+        self.store = store
+        return review_input_and_score(store, warning_count)
+
+    # pylint: disable=too-many-arguments
+    def _report_schedule(self, costs, jobs, predicted, timings, started):
+        """
+        Record how long each checker took on its files in costs, and
+        report the predicted and actual makespan of the checkers.
+        """
+        if not timings:
+            return
+        for path, (start, end) in timings.items():
+            costs.record(os.path.basename(path), jobs[path][1], end - start)
+            self.metrics.count('checker_predicted_seconds', predicted[path],
+                               checker=os.path.basename(path))
+        costs.save()
+        workers = max(CHECKPATCH_JOBS, 1)
+        predicted_makespan = checker_costs.makespan(predicted, workers)
+        makespan = max(end for _, end in timings.values()) - started
+        self.metrics.count('checker_makespan_predicted_seconds',
+                           predicted_makespan, workers=workers)
+        self.metrics.count('checker_makespan_seconds', makespan,
+                           workers=workers)
+        self._debug("check_patch: %d checkers on %d workers, makespan "
+                    "%.2fs, predicted %.2fs", len(timings), workers,
+                    makespan, predicted_makespan)
+
+    def merge_matrix(self, files):
+        """
+        Merge the results the matrix legs saved in REVIEW_MATRIX_DIR,
+        return a ReviewInput() and score.
+        """
+        legs = review_matrix.load_legs(os.getenv('GIT_COMMIT'))
+        if not legs:
+            print("No matrix results found in %s" %
+                  review_matrix.REVIEW_MATRIX_DIR)
+            sys.exit(1)
+        self._debug("review matrix: merging %s", ', '.join(sorted(legs)))
+        store, warning_count = review_matrix.merge_legs(legs, files)
+        self.store = store
+        return review_input_and_score(store, warning_count)
 
     def pull_patch(self):
+        """
+        Return the patch under review, as bytes, from PATCHFILE if set,
+        else the local checkout, falling back to downloading it from
+        GitHub.  PATCH_SOURCE=git or PATCH_SOURCE=http restricts this to
+        one of those two sources.
+        """
         if self.patch:
             return self.patch
+        source = os.getenv('PATCH_SOURCE', 'auto')
+        data = None
         try:
             if 'PATCHFILE' in os.environ:
                 self._debug("Using patch in file %s" % os.environ['PATCHFILE'])
-                self.patch = open(os.environ['PATCHFILE']).read()
+                with open(os.environ['PATCHFILE'], 'rb') as patchfile:
+                    data = patchfile.read()
             else:
-                # I am sure there has got to be a way to arrive at this
-                # patch from the local repo, ignoring merge commits, etc.
-                ##cmd = ["git", "diff", "{}..{}".format(self.commits[0].sha,
-                #                                      #self.commits[0].parents[0].sha)]
-                # this is pretty much what we want *except* we need to know
-                # know the name of the remote that the base.ref is in which
-                # makes it pretty unportable
-                # maybe we can revisit this all when we refactor for a git hook
-                #cmd = ["git", "diff", "origin/{}...HEAD".format(
-                #    self.pull_request.base.ref), '--stat']
-                #print cmd
-                #patch = subprocess.check_output(cmd)
-                # so for now, just use this simple (but lazy and inefficient)
-                # method
-                session = requests.Session()
-                url = "https://github.com/{}/{}/pull/{}.diff".format(self.project,
-                                                                     self.repo,
-                                                                     self.pull_request.number)
-                resp = session.get(url)
-                self.patch = resp.text
+                if source != 'http':
+                    target = os.getenv('CHANGE_TARGET') or \
+                             self.pull_request.base.ref
+                    commit = os.getenv('GIT_COMMIT', 'HEAD')
+                    try:
+                        data = git_diff_patch(target, commit)
+                        self._debug("Using patch from git diff %s...%s",
+                                    target, commit)
+                    except (OSError, subprocess.CalledProcessError) as excpn:
+                        if source == 'git':
+                            raise
+                        self._debug("git diff failed, downloading the "
+                                    "patch instead: %s", excpn)
+                if data is None:
+                    data = self._fetch('diff', self._download_patch).result()
         except subprocess.CalledProcessError as excpn:
             if excpn.returncode == 128:
                 print("""Got error 128 trying to run git diff.
@@ -679,12 +1220,26 @@ Was there a race with getting the base from the pull request?
 I.e. was a new revision of the patch pushed before we could get
 the pull request data on the previous one?""")
             raise
-        for line in self.patch.splitlines():
-            if line.startswith("--- a/") or \
-               line.startswith("+++ b/"):
-                self.patch_files.add(line.rstrip()[6:])
+        # The patch is parsed once here, for its files now and the lines
+        # it adds when the review is posted.
+        try:
+            self.diff = diff_model.DiffModel(data)
+        except ValueError as excpn:
+            print(excpn)
+            sys.exit(1)
+        self.patch = data
+        self.patch_files = self.diff.paths()
         return self.patch
 
+    def _download_patch(self):
+        """The pull request's diff, as bytes, from GitHub"""
+        session = requests.Session()
+        url = "https://github.com/{}/{}/pull/{}.diff".format(
+            self.project, self.repo, os.environ['CHANGE_ID'])
+        with self.metrics.span('download_patch'):
+            resp = session.get(url)
+        return resp.content
+
     def review_change(self):
         """
         Review the current patch on HEAD
@@ -692,23 +1247,57 @@ the pull request data on the previous one?""")
         * POST review to github.
         """
         score = 1
-        patch = self.pull_patch()
+        with self.metrics.span('pull_patch'):
+            patch = self.pull_patch()
         if not patch:
             self._debug("review_change: no patch")
+            self.close()
             return score
 
-        review_input, score = self.check_patch(patch, self.patch_files)
+        if review_matrix.is_merge():
+            with self.metrics.span('merge_matrix'):
+                review_input, score = self.merge_matrix(self.patch_files)
+        else:
+            with self.metrics.span('check_patch'):
+                review_input, score = self.check_patch(patch,
+                                                       self.patch_files)
         review_input['files'] = self.patch_files
         self._debug("review_change: score = %d", score)
 
-        self.run_from_diff(review_input)
+        # A matrix leg leaves posting to the step that merges all of them.
+        if review_matrix.is_leg():
+            self.close()
+            return score
+
+        with self.metrics.span('run_from_diff'):
+            self.run_from_diff(review_input)
 
         # add patch line numbers to review_input
-        add_patch_linenos(review_input, patch)
+        with self.metrics.span('add_patch_linenos'):
+            add_patch_linenos(review_input, self.diff)
 
-        score = self.post_review(review_input)
+        try:
+            with self.metrics.span('post_review'):
+                score = self.post_review(review_input)
+        finally:
+            self.close()
         return score
 
+    def write_metrics(self):
+        """
+        Add the GitHub API calls made through self.github and the time
+        spent waiting to retry them to the metrics, and write them out.
+        """
+        scheduler = self.github.scheduler
+        self.metrics.count('github_requests', self.github.requests,
+                           method='GET')
+        for method, count in self.github.sent.items():
+            self.metrics.count('github_requests', count, method=method)
+        self.metrics.count('github_not_modified', self.github.not_modified)
+        self.metrics.count('github_retries', scheduler.retries)
+        self.metrics.count('github_retry_sleep_seconds', scheduler.slept)
+        self.metrics.write()
+
     def update_single_change(self):
         """_"""
 
@@ -718,61 +1307,6 @@ the pull request data on the previous one?""")
         """Update review_input with new comments based on current
         contents of source tree
         """
-
-        def create_comment(header, patch_segment):
-            """returns a comment"""
-            elems = header.split(' ')
-            lineparts = elems[1].split(',')
-            lineno = int(lineparts[0]) * -1
-
-            in_patch = False
-            add_count = 0
-            remove_count = 0
-            new_text = []
-            append_text = []
-            start_line = -1
-            end_line = -1
-            comment = {'include_in_extra': False}
-
-            for line in patch_segment:
-                if line.startswith('+'):
-                    add_count += 1
-                    if append_text:
-                        new_text.extend(append_text)
-                        lineno += len(append_text)
-                        append_text = []
-                    if not in_patch:
-                        in_patch = True
-                        start_line = lineno
-                        append_text = []
-                    new_text.append(line[1:])
-                    if end_line < lineno:
-                        end_line = lineno
-                    lineno += 1
-                elif line.startswith('-'):
-                    remove_count += 1
-                    if not in_patch:
-                        lineno += len(append_text)
-                        append_text = []
-                        in_patch = True
-                        start_line = lineno
-                else:
-                    append_text.append(line[1:])
-            comment['message'] = '```suggestion\n{}\n```'.format('\n'.join(new_text))
-            if start_line == end_line:
-                comment['line'] = start_line
-            else:
-                comment['start_line'] = start_line
-                comment['line'] = end_line
-
-            if remove_count == 1 and add_count == 0:
-                comment['side'] = 'LEFT'
-            else:
-                comment['side'] = 'RIGHT'
-            if 'start_line' in comment:
-                comment['start_side'] = comment['side']
-            return comment
-
         cmd=['git', 'diff', '-U1']
 
         pipe = subprocess.Popen(cmd,
@@ -781,65 +1315,17 @@ the pull request data on the previous one?""")
                                 stderr=subprocess.PIPE)
 
         out, err = pipe.communicate()
+        if pipe.returncode:
+            self._error("run_from_diff: %s exited %d: %s", ' '.join(cmd),
+                        pipe.returncode, err.decode('utf-8', 'replace'))
 
-        skip_prefix = ['diff', 'index', '+++ b/']
-
-        filename = None
-        parts = []
-        lineno = None
-
-        if 'comments' not in review_input:
-            review_input['comments'] = {}
-
-        patch_segment = []
-        header = None
-        for line in out.decode('utf-8').splitlines():
-            skip = False
-            for prefix in skip_prefix:
-                if line.startswith(prefix):
-                    skip = True
-                    continue
-            if skip:
-                continue
-            if line.startswith('--- a/'):
-                if patch_segment:
-                    new_comment = create_comment(header, patch_segment)
-                    if filename not in review_input['comments']:
-                        review_input['comments'][filename] = [new_comment]
-                    else:
-                        review_input['comments'][filename].append(new_comment)
-                patch_segment = []
-                header = line
-
-                _, filename = line.split('/', 1)
-
-            elif line.startswith('@@ '):
-                if patch_segment:
-                    new_comment = create_comment(header, patch_segment)
-                    if filename not in review_input['comments']:
-                        review_input['comments'][filename] = [new_comment]
-                    else:
-                        review_input['comments'][filename].append(new_comment)
-                patch_segment = []
-                header = line
-            elif line.startswith('-'):
-                patch_segment.append(line)
-            elif line.startswith('+'):
-                patch_segment.append(line)
-            else:
-                patch_segment.append(line)
-
-        if patch_segment:
-            new_comment = create_comment(header, patch_segment)
-            if filename not in review_input['comments']:
-                review_input['comments'][filename] = [new_comment]
-            else:
-                review_input['comments'][filename].append(new_comment)
-
-def main():
-    """_"""
-    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+        diff_suggestions(out, review_input.setdefault('comments', {}))
 
+def run_review():
+    """
+    Review the change described by the environment, exiting 0 if it
+    passed and 1 if not.
+    """
     try:
         reviewer = Reviewer()
     except NotPullRequest:
@@ -855,11 +1341,32 @@ def main():
         pprint.PrettyPrinter(indent=4).pprint(review_comments)
         return
 
-    score = reviewer.update_single_change()
+    try:
+        score = reviewer.update_single_change()
+    finally:
+        reviewer.write_metrics()
     if score > 0:
         sys.exit(0)
     sys.exit(1)
 
 
+def main():
+    """_"""
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        review_daemon.serve(sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+
+    # Hand the review to a running daemon if there is one, else do it here.
+    if review_daemon.REVIEW_DAEMON_SOCKET:
+        status = review_daemon.submit(review_daemon.REVIEW_DAEMON_SOCKET,
+                                      dict(os.environ), os.getcwd())
+        if status is not None:
+            sys.exit(status)
+
+    run_review()
+
+
 if __name__ == "__main__":
     main()
@@ -29,6 +29,13 @@ if [ -n "${distro}" ]; then
   fi
 fi
 : "${FULL_REVIEW:=1}"
+# With REVIEW_MATRIX_DIR set each leg of the matrix saves its results
+# there under its distro, and a final run with REVIEW_MATRIX_MERGE=true
+# posts one review for all of them.
+if [ -n "${REVIEW_MATRIX_DIR}" ] && [ -n "${distro}" ]; then
+  : "${REVIEW_MATRIX_LEG:="${distro}"}"
+  export REVIEW_MATRIX_DIR REVIEW_MATRIX_LEG
+fi
 set -u
 
 # colon separated list
@@ -64,6 +71,8 @@ if [ -n "${CORAL_ARTIFACTS}" ]; then
 fi
 set -u
 : "${REVIEW_HISTORY_BASE:="${PWD}"}"
+# The lint result cache is kept under REVIEW_HISTORY_BASE
+export REVIEW_HISTORY_BASE
 export REVIEW_HISTORY_PATH="${REVIEW_HISTORY_BASE}"/REVIEW_HISTORY
 
 if [ ! -e "$REVIEW_HISTORY_PATH" ]; then
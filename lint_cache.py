@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Lint Result Cache
+~~~~ ~~~~~~ ~~~~~
+
+* Cache parsed checker results per file, keyed by git blob SHA and the
+  checker configuration.
+* Shared by concurrent review jobs through atomic writes.
+* Bounded in size with least-recently-used eviction.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+# Checkers whose output for a file depends only on that file's contents
+# (and so can be cached per file).  Anything else, e.g. checkpatch.pl or
+# check_make_output.sh, is always run.
+LINT_CACHE_CHECKERS = os.getenv('LINT_CACHE_CHECKERS',
+                                'check_python.sh:shellcheck_scripts.sh:'
+                                'check_yaml.sh:check_json.sh:'
+                                'check_ruby.sh').split(':')
+LINT_CACHE_MAX_BYTES = int(os.getenv('LINT_CACHE_MAX_MB', '512')) * 1024 * 1024
+
+# Commands that report the version of the linter behind each checker.
+LINTER_VERSION_COMMANDS = {
+    'check_python.sh': ['pylint', '--version'],
+    'shellcheck_scripts.sh': ['shellcheck', '--version'],
+    'check_yaml.sh': ['yamllint', '--version'],
+    'check_json.sh': ['jsonlint', '--version'],
+    'check_ruby.sh': ['ruby-lint', '--version'],
+}
+
+# Version of what an entry holds, as parsed by checker_output.  It is
+# part of every key, so it must go up whenever a parser or the form of
+# the stored results changes, for the entries of the old ones to be
+# left for eviction rather than served.
+CACHE_SCHEMA = 2
+
+# The umask, to give the entries that mkstemp() makes 0600 the mode open()
+# would, so executors running as other users can share the cache.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Files that change what a checker reports without being in the patch.
+CONFIG_FILE_NAMES = ('pylint.rc', 'pylint3.rc', 'check_modules.sh')
+
+# Reports that depend on files other than the one linted, such as a
+# module it imports or a script it sources, and so can not be cached by
+# that file's blob SHA.
+CONTEXT_COMMENT_RE = re.compile(r'\((?:pylint-)?(?:import-error|'
+                                r'no-name-in-module)\)|\[SC1091\]')
+
+# Where the linter versions are remembered, at the top of the cache.
+VERSIONS_FILE = 'linter_versions.json'
+
+
+def _sha256(data):
+    """_"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_sha256(path):
+    """sha256 of the file at path, or '' if it can not be read"""
+    try:
+        with open(path, 'rb') as config:
+            return _sha256(config.read())
+    except (IOError, OSError):
+        return ''
+
+
+def _linter_version(name):
+    """Output of the version command for the checker called name"""
+    cmd = LINTER_VERSION_COMMANDS.get(name)
+    if not cmd:
+        return ''
+    try:
+        return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode(
+            'utf-8', 'replace')
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _linter_stamp(name):
+    """
+    "REALPATH MTIME SIZE" of the linter behind the checker called name, to
+    tell whether it changed since its version was last asked, or '' if it
+    is not installed.
+    """
+    cmd = LINTER_VERSION_COMMANDS.get(name)
+    linter = cmd and shutil.which(cmd[0])
+    if not linter:
+        return ''
+    linter = os.path.realpath(linter)
+    try:
+        stat = os.stat(linter)
+    except OSError:
+        return ''
+    return '%s %d %d' % (linter, stat.st_mtime_ns, stat.st_size)
+
+
+def find_config_files(repo):
+    """
+    Find the first of each of CONFIG_FILE_NAMES under repo, the same way
+    check_python.sh does with find -print -quit.
+
+    Returns { NAME: PATH, ... }.
+    """
+    found = {}
+    for root, dirs, names in os.walk(repo):
+        dirs[:] = [d for d in dirs if d != '.git']
+        for name in CONFIG_FILE_NAMES:
+            if name in names and name not in found:
+                found[name] = os.path.join(root, name)
+        if len(found) == len(CONFIG_FILE_NAMES):
+            break
+    return found
+
+
+def blob_shas(files, repo='.'):
+    """
+    Git blob SHAs of the working tree contents of files, computed with a
+    single git hash-object.
+
+    Returns { PATH: SHA, ... } for the files that exist.
+    """
+    paths = sorted(path for path in files
+                   if os.path.isfile(os.path.join(repo, path)))
+    if not paths:
+        return {}
+    try:
+        out = subprocess.check_output(['git', 'hash-object', '--stdin-paths'],
+                                      input='\n'.join(paths).encode('utf-8'),
+                                      cwd=repo, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    shas = out.decode('ascii').split()
+    if len(shas) != len(paths):
+        return {}
+    return dict(zip(paths, shas))
+
+
+class LintCache(object):
+    """
+    On disk cache of { LINE: [[LEVEL, COMMENT], ...] } results for one
+    file and checker.
+
+    Entries live in path/XX/KEY.json.  Writes go to a temporary file that
+    is renamed into place so readers never see a partial entry, and a hit
+    refreshes the entry's mtime so eviction can drop the least recently
+    used entries first.
+    """
+    def __init__(self, path, max_bytes=LINT_CACHE_MAX_BYTES, repo='.',
+                 checkpatch_args=None, ignored=None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.repo = repo
+        self.checkpatch_args = checkpatch_args or []
+        self.ignored = ignored or []
+        self._config_files = None
+        self._config_keys = {}
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, key):
+        """_"""
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def config_files(self):
+        """_"""
+        if self._config_files is None:
+            self._config_files = find_config_files(self.repo)
+        return self._config_files
+
+    def _load_versions(self):
+        """
+        { NAME: [STAMP, VERSION] } of the linter versions remembered in
+        linter_versions.json, as running pylint --version alone takes
+        longer than a warm commit hook should.
+        """
+        try:
+            with open(os.path.join(self.path, VERSIONS_FILE),
+                      encoding='utf-8') as versions:
+                return json.load(versions)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_versions(self, remembered):
+        """_"""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as versions:
+                    json.dump(remembered, versions)
+                os.chmod(tmp_path, 0o666 & ~UMASK)
+                os.replace(tmp_path, os.path.join(self.path, VERSIONS_FILE))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as excpn:
+            self.logger.debug("lint cache: could not save %s: %s",
+                              VERSIONS_FILE, excpn)
+
+    def linter_version(self, checker):
+        """
+        The version of the linter behind checker, only asked of the linter
+        again when its stamp (path, mtime and size) changes.
+        """
+        name = os.path.basename(checker)
+        if name in self._versions:
+            return self._versions[name]
+        stamp = _linter_stamp(name)
+        if not stamp:
+            version = _linter_version(name)
+        else:
+            remembered = self._load_versions()
+            if remembered.get(name, [None])[0] == stamp:
+                version = remembered[name][1]
+            else:
+                version = _linter_version(name)
+                if version:
+                    remembered[name] = [stamp, version]
+                    self._save_versions(remembered)
+        self._versions[name] = version
+        return version
+
+    def cacheable(self, checker):
+        """
+        Whether checker's results can be cached per file.
+        """
+        name = os.path.basename(checker)
+        if name not in LINT_CACHE_CHECKERS:
+            return False
+        # Without the linter the checker reports nothing, which must not
+        # be cached as a clean result.
+        if name in LINTER_VERSION_COMMANDS and \
+           not self.linter_version(checker):
+            return False
+        # A project check_modules.sh lints whatever it likes rather than
+        # just the files it is given.
+        if name == 'check_python.sh' and \
+           'check_modules.sh' in self.config_files():
+            return False
+        return True
+
+    def config_key(self, checker):
+        """
+        Hash of everything other than the file contents that affects what
+        checker reports: the checker itself, its linter version, the
+        project lint configuration and CHECKPATCH_ARGS, along with
+        CACHE_SCHEMA.
+        """
+        if checker in self._config_keys:
+            return self._config_keys[checker]
+        parts = ['schema %d' % CACHE_SCHEMA,
+                 os.path.realpath(checker),
+                 _file_sha256(checker),
+                 self.linter_version(checker)]
+        for config_name, config_path in sorted(self.config_files().items()):
+            parts.append('%s=%s' % (config_name, _file_sha256(config_path)))
+        parts.append(' '.join(self.checkpatch_args))
+        parts.append(' '.join(self.ignored))
+        key = _sha256('\0'.join(parts).encode('utf-8'))
+        self._config_keys[checker] = key
+        return key
+
+    def key(self, checker, blob_sha):
+        """_"""
+        return _sha256(('%s\0%s' % (self.config_key(checker),
+                                    blob_sha)).encode('utf-8'))
+
+    def get(self, key):
+        """
+        Return the cached { LINE: [[LEVEL, COMMENT], ...] } for key, or
+        None.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, encoding='utf-8') as entry:
+                data = json.load(entry)
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {int(line): comments for line, comments in data.items()}
+
+    def put(self, key, line_comments):
+        """
+        Atomically store { LINE: [[LEVEL, COMMENT], ...] } for key, unless
+        any of the comments depend on other files (CONTEXT_COMMENT_RE).
+        """
+        if any(CONTEXT_COMMENT_RE.search(comment)
+               for comments in line_comments.values()
+               for _, comment in comments):
+            return
+        entry_path = self._entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as entry:
+                    json.dump({str(line): comments
+                               for line, comments in line_comments.items()},
+                              entry)
+                os.chmod(tmp_path, 0o666 & ~UMASK)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as excpn:
+            self.logger.debug("lint cache: could not store %s: %s",
+                              key, excpn)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is back under
+        max_bytes.
+        """
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.path):
+            # Entries are in subdirectories, other files (e.g. the
+            # file_types memo) are at the top.
+            if root == self.path:
+                continue
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                entry_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, entry_path in entries:
+            try:
+                os.unlink(entry_path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def open_cache(repo='.', checkpatch_args=None, ignored=None):
+    """
+    Return the LintCache for this job, or None if there is nowhere to keep
+    one.  The cache lives in LINT_CACHE_DIR, or in lint_cache under
+    REVIEW_HISTORY_BASE.
+    """
+    path = os.getenv('LINT_CACHE_DIR')
+    if not path:
+        base = os.getenv('REVIEW_HISTORY_BASE')
+        if not base and os.getenv('REVIEW_HISTORY_PATH'):
+            base = os.path.dirname(os.environ['REVIEW_HISTORY_PATH'])
+        if not base:
+            return None
+        path = os.path.join(base, 'lint_cache')
+    return LintCache(path, repo=repo, checkpatch_args=checkpatch_args,
+                     ignored=ignored)
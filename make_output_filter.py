@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Make Output Filter
+~~~~ ~~~~~~ ~~~~~~
+
+* Pick out the compiler diagnostics (path:line:[col:] ...) in a build log
+  that are for files in the review.
+* Match each diagnostic's path against the set of changed paths, however
+  the build spelt it (src/a.c, ./src/a.c, ../src/a.c, /build/dir/src/a.c).
+* Show a diagnostic repeated by several compile units, e.g. one in a
+  header, only once.
+
+usage: make_output_filter.py [-0] MAKE_OUTPUT < CHANGED_PATHS
+
+The changed paths (relative to the top of the project) are read from
+stdin, separated by white space, or with -0 by NULs.  Matching lines are written to stdout
+with the path as it is in the project.  The exit status is 0 if there
+were any, else 1, as for grep.
+"""
+
+import mmap
+import posixpath
+import re
+import sys
+
+# What follows path: in a diagnostic, line: or line:col:
+LOCATION_RE = re.compile(rb'\d+:(?:\d+:)?')
+
+# How much of a log is scanned at a time.
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class ChangedPaths(object):
+    """
+    Set of changed paths that a path from a build log can be looked up
+    in by its trailing components.
+    """
+    def __init__(self, paths):
+        self.paths = set()
+        self.basenames = set()
+        for path in paths:
+            path = posixpath.normpath(path)
+            self.paths.add(path)
+            self.basenames.add(posixpath.basename(path))
+
+    def match(self, path):
+        """
+        The changed path that path (as found in a build log) is, or None.
+        """
+        # Almost every other path is rejected here.
+        if posixpath.basename(path) not in self.basenames:
+            return None
+        path = posixpath.normpath(path)
+        if path in self.paths:
+            return path
+        # Any other relative path is a different file in the project, only
+        # a path out of the build directory can end with a changed path.
+        if not path.startswith((b'/', b'../')):
+            return None
+        # Try each shorter trailing part of the path, so the longest
+        # (most specific) one that matches wins.
+        start = path.find(b'/')
+        while start >= 0:
+            suffix = path[start + 1:]
+            if suffix in self.paths:
+                return suffix
+            start = path.find(b'/', start + 1)
+        return None
+
+
+def _blocks(log):
+    """
+    The contents of log in blocks of about BLOCK_SIZE that end at a line
+    break, mapped from the file where possible rather than read.
+    """
+    try:
+        contents = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # Empty, or not a regular file.
+        contents = None
+    if contents is not None:
+        with contents:
+            start = 0
+            while start < len(contents):
+                end = contents.find(b'\n', start + BLOCK_SIZE) + 1 or \
+                      len(contents)
+                yield contents[start:end]
+                start = end
+        return
+    rest = b''
+    while True:
+        block = log.read(BLOCK_SIZE)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind(b'\n') + 1
+        rest = block[end:]
+        if end:
+            yield block[:end]
+    if rest:
+        yield rest
+
+
+def filter_log(log, changed, out):
+    """
+    Write the diagnostics in log for changed (a ChangedPaths) to out,
+    each distinct one once.
+
+    Returns how many were written.
+    """
+    seen = set()
+    basenames = changed.basenames
+    for block in _blocks(log):
+        for line in block.split(b'\n'):
+            path, colon, rest = line.partition(b':')
+            # The cheap test first, as most lines are for other files.
+            if not colon or path[path.rfind(b'/') + 1:] not in basenames:
+                continue
+            location = LOCATION_RE.match(rest)
+            if not location:
+                continue
+            path = changed.match(path)
+            if path is None:
+                continue
+            key = (path, rest)
+            if key in seen:
+                continue
+            seen.add(key)
+            out.write(b'%s:%s\n' % (path, rest))
+    return len(seen)
+
+
+def main():
+    """_"""
+    args = sys.argv[1:]
+    null = args[:1] == ['-0']
+    if null:
+        args = args[1:]
+    if len(args) != 1:
+        print("usage: make_output_filter.py [-0] MAKE_OUTPUT < CHANGED_PATHS")
+        sys.exit(2)
+    paths = sys.stdin.buffer.read()
+    if null:
+        paths = [path for path in paths.split(b'\0') if path]
+    else:
+        paths = paths.split()
+    changed = ChangedPaths(paths)
+    with open(args[0], 'rb') as log:
+        found = filter_log(log, changed, sys.stdout.buffer)
+    sys.exit(0 if found else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Review Metrics
+~~~~~~ ~~~~~~~
+
+* Time each phase of a review, and each checker, as named spans.
+* Count GitHub API requests, retries and the time spent waiting to
+  retry, and the bytes of patch and checker output processed.
+* Write the lot to REVIEW_METRICS_JSON and, for node_exporter's textfile
+  collector, to REVIEW_METRICS_PROM, when they are set.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+REVIEW_METRICS_JSON = os.getenv('REVIEW_METRICS_JSON')
+REVIEW_METRICS_PROM = os.getenv('REVIEW_METRICS_PROM')
+# Prefix of the Prometheus metric names.
+REVIEW_METRICS_PREFIX = os.getenv('REVIEW_METRICS_PREFIX', 'code_review_')
+
+PROM_NAME_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _key(name, labels):
+    """_"""
+    return (name, tuple(sorted(labels.items())))
+
+
+def _atomic_write(path, text):
+    """Write text to path through a temporary file renamed into place"""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            out.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Metrics(object):
+    """
+    Span timings and counters for one review, each with a name and
+    optional labels, e.g. span('checker', checker='checkpatch.pl').  Spans
+    and counts of the same name and labels add up.  Safe to use from the
+    checker threads.
+    """
+    def __init__(self, labels=None, clock=time.monotonic):
+        self.logger = logging.getLogger(__name__)
+        self.clock = clock
+        self.started = clock()
+        self.labels = dict(labels or {})
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    def add_span(self, name, seconds, **labels):
+        """Add seconds to the span name"""
+        key = _key(name, labels)
+        with self.lock:
+            total, count = self.spans.get(key, (0.0, 0))
+            self.spans[key] = (total + seconds, count + 1)
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        """Time the body of a with statement as the span name"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_span(name, self.clock() - start, **labels)
+
+    def count(self, name, value=1, **labels):
+        """Add value to the counter name"""
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def report(self):
+        """
+        The metrics as { 'labels': {...}, 'elapsed_seconds': SECONDS,
+        'spans': [{ 'span': NAME, 'seconds': ..., 'count': ..., LABEL: ...
+        }, ...], 'counters': [{ 'counter': NAME, 'value': ..., LABEL: ...
+        }, ...] }.
+        """
+        with self.lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+        return {
+            'labels': self.labels,
+            'elapsed_seconds': self.clock() - self.started,
+            'spans': [dict(labels, span=name, seconds=total, count=count)
+                      for (name, labels), (total, count) in spans],
+            'counters': [dict(labels, counter=name, value=value)
+                         for (name, labels), value in counters],
+            }
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        report = self.report()
+
+        def sample(name, labels, value):
+            """_"""
+            labels = dict(report['labels'], **labels)
+            text = ','.join('%s="%s"' % (PROM_NAME_RE.sub('_', label),
+                                         str(labels[label])
+                                         .replace('\\', '\\\\')
+                                         .replace('"', '\\"')
+                                         .replace('\n', '\\n'))
+                            for label in sorted(labels))
+            return '%s%s %s' % (name, '{%s}' % text if text else '', value)
+
+        prefix = PROM_NAME_RE.sub('_', REVIEW_METRICS_PREFIX)
+        lines = ['# TYPE %selapsed_seconds gauge' % prefix,
+                 sample(prefix + 'elapsed_seconds', {},
+                        report['elapsed_seconds']),
+                 '# TYPE %sspan_seconds gauge' % prefix]
+        for span in report['spans']:
+            labels = {key: value for key, value in span.items()
+                      if key not in ('seconds', 'count')}
+            lines.append(sample(prefix + 'span_seconds', labels,
+                                span['seconds']))
+        names = []
+        for counter in report['counters']:
+            name = prefix + PROM_NAME_RE.sub('_', counter['counter'])
+            if name not in names:
+                names.append(name)
+                lines.append('# TYPE %s gauge' % name)
+            labels = {key: value for key, value in counter.items()
+                      if key not in ('counter', 'value')}
+            lines.append(sample(name, labels, counter['value']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, prom_path=None):
+        """
+        Write the report to json_path and prom_path, REVIEW_METRICS_JSON
+        and REVIEW_METRICS_PROM by default, whichever are set.
+        """
+        json_path = json_path or REVIEW_METRICS_JSON
+        prom_path = prom_path or REVIEW_METRICS_PROM
+        try:
+            if json_path:
+                _atomic_write(json_path,
+                              json.dumps(self.report(), indent=2) + '\n')
+            if prom_path:
+                _atomic_write(prom_path, self.prometheus())
+        except (IOError, OSError) as excpn:
+            self.logger.debug("metrics: could not write the report: %s",
+                              excpn)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Patch Staging
+~~~~~ ~~~~~~~
+
+* Write the patch under review, as bytes, once to a private temporary
+  directory, in /dev/shm where there is one so that it stays in memory,
+  for every checker to read on its stdin.
+* Write each file list given to a checker there too, NUL separated so
+  that no file name is mangled, as FILELIST_FILE and a
+  FILELIST_<TYPE>_FILE for each of file_types.TYPES.
+"""
+
+import os
+import shutil
+import tempfile
+
+import file_types
+
+# Where the patch is staged, /dev/shm (or else the usual temporary
+# directory) by default.
+REVIEW_STAGE_DIR = os.getenv('REVIEW_STAGE_DIR')
+
+
+def _stage_base():
+    """_"""
+    if REVIEW_STAGE_DIR:
+        return REVIEW_STAGE_DIR
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK | os.X_OK):
+        return '/dev/shm'
+    return None
+
+
+class PatchStage(object):
+    """
+    Temporary directory holding the patch and the file lists for the
+    checkers of one review, removed by close().
+    """
+    def __init__(self, patch, base=None):
+        self.path = tempfile.mkdtemp(prefix='checkpatch-',
+                                     dir=base or _stage_base())
+        self.patch_path = os.path.join(self.path, 'patch')
+        self.lists = {}
+        self._write(self.patch_path, patch)
+
+    @staticmethod
+    def _write(path, data):
+        """_"""
+        with open(path, 'wb') as out:
+            out.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open_patch(self):
+        """The patch, opened for one checker's stdin"""
+        return open(self.patch_path, 'rb')
+
+    def file_list(self, files):
+        """
+        The path of a file listing files, each followed by a NUL, written
+        the first time that list is asked for.
+        """
+        key = tuple(files)
+        if key not in self.lists:
+            path = os.path.join(self.path, 'filelist%d' % len(self.lists))
+            self._write(path, b''.join(os.fsencode(filename) + b'\0'
+                                       for filename in files))
+            self.lists[key] = path
+        return self.lists[key]
+
+    def env(self, files, types):
+        """
+        { 'FILELIST_FILE': PATH, 'FILELIST_<TYPE>_FILE': PATH, ... } for
+        files, whose types are in types ({ PATH: TYPE }).
+        """
+        env = {'FILELIST_FILE': self.file_list(files)}
+        for file_type in file_types.TYPES:
+            env['FILELIST_%s_FILE' % file_type.upper()] = self.file_list(
+                [filename for filename in files
+                 if types.get(filename) == file_type])
+        return env
+
+    def close(self):
+        """Remove the staged files"""
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Batched Pylint Runner
+~~~~~~~ ~~~~~~ ~~~~~~
+
+* Pick out the Python scripts in a list of files with file_types.
+* Lint all of the scripts that share an rc file with one in-process
+  pylint run, using pylint's parallel jobs.
+* Report with check_python.sh's "{path}:{line}: pylint-{symbol}: {msg}"
+  template, writing the full pylint output to --output and the message
+  lines to stdout.
+* With PYLINT_BATCH_SOCKET set (as review_daemon does for its jobs), hand
+  the run to the resident pylint of that review worker rather than
+  importing pylint again, and fall back to running it here if nothing is
+  listening.
+
+usage: pylint_batch.py [--pylint-rc RC] [--pylint3-rc RC] [--output LOG]
+                       [--jobs N] FILE...
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+import file_types
+
+MSG_TEMPLATE = '{path}:{line}: pylint-{symbol}: {msg}'
+# Parallel pylint jobs per run, 0 for one per CPU.
+PYLINT_JOBS = int(os.getenv('PYLINT_JOBS', '0'))
+# Unix socket of a resident pylint (see serve()) to run on.
+PYLINT_BATCH_SOCKET = os.getenv('PYLINT_BATCH_SOCKET')
+
+# The template of a resident pylint, which does not share the client's
+# directory, so reports absolute paths for batch() to make relative.
+RESIDENT_MSG_TEMPLATE = '{abspath}:{line}: pylint-{symbol}: {msg}'
+
+
+def python_scripts(files):
+    """
+    Split out the Python scripts in files into those that name python3 on
+    their #! line and the rest.
+
+    Returns (PYTHON3_FILES, PYTHON_FILES).
+    """
+    types = file_types.FileTypes().classify(
+        [path for path in files if os.path.isfile(path)])
+    return ([path for path in files if types.get(path) == 'python3'],
+            [path for path in files if types.get(path) == 'python'])
+
+
+def run_pylint(files, rcfile, jobs, output, template=MSG_TEMPLATE):
+    """
+    Lint files in one pylint run, writing its report to output.
+
+    Returns pylint's exit status.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pylint.lint import Run
+    from pylint.reporters.text import TextReporter
+
+    args = ['--msg-template', template, '--jobs', str(jobs)]
+    if rcfile:
+        args.append('--rcfile=%s' % rcfile)
+    # The report goes to output through the reporter alone: swapping
+    # sys.stdout would take the output of every thread of the process,
+    # such as the review a resident pylint runs beside.
+    try:
+        run = Run(args + files, reporter=TextReporter(output), exit=False)
+    except SystemExit as excpn:
+        return excpn.code if isinstance(excpn.code, int) else 1
+    return run.linter.msg_status
+
+
+def batch(files, pylint_rc='', pylint3_rc='', jobs=PYLINT_JOBS, cwd=None):
+    """
+    Lint the Python scripts in files with one pylint run per rc file.
+    cwd, for a resident pylint, is the directory files and the rc files
+    are relative to, and that the report's paths are made relative to.
+
+    Returns (EXIT_STATUS, REPORT).
+    """
+    template = MSG_TEMPLATE
+    if cwd:
+        files = [os.path.join(cwd, path) for path in files]
+        pylint_rc = pylint_rc and os.path.join(cwd, pylint_rc)
+        pylint3_rc = pylint3_rc and os.path.join(cwd, pylint3_rc)
+        template = RESIDENT_MSG_TEMPLATE
+    python3, python = python_scripts(files)
+    rc = 0
+    output = io.StringIO()
+    # Default python, which on current Fedora, etc is same as python3, so
+    # both groups are linted here.
+    for batch_files, rcfile in ((python3, pylint3_rc), (python, pylint_rc)):
+        if batch_files:
+            rc += run_pylint(batch_files, rcfile, jobs, output, template)
+    report = output.getvalue()
+    if cwd:
+        prefix = os.path.join(cwd, '')
+        report = ''.join(line[len(prefix):] if line.startswith(prefix)
+                         else line for line in report.splitlines(True))
+    return rc, report
+
+
+def _clear_caches():
+    """
+    Forget what the last run parsed, as a resident pylint lints a new
+    checkout each time.
+    """
+    # pylint: disable=import-outside-toplevel
+    from astroid import MANAGER
+    try:
+        from pylint.checkers.clear_lru_cache import clear_lru_caches
+        clear_lru_caches()
+    except ImportError:
+        pass
+    MANAGER.clear_cache()
+
+
+class _BatchHandler(socketserver.StreamRequestHandler):
+    """
+    Run one batch(), given as a JSON line, and write back its result.
+    """
+    def handle(self):
+        try:
+            job = json.loads(self.rfile.readline().decode('utf-8'))
+            args = (job['files'], job['pylint_rc'], job['pylint3_rc'])
+            cwd = job['cwd']
+        except (ValueError, KeyError, TypeError) as excpn:
+            result = (1, 'bad pylint job: %s\n' % excpn)
+        else:
+            # pylint is neither thread safe nor to be forked from a
+            # threaded process, so runs are one at a time, each in one
+            # process.
+            with self.server.lock:
+                try:
+                    result = batch(*args, jobs=1, cwd=cwd)
+                finally:
+                    _clear_caches()
+        self.wfile.write(json.dumps({'status': result[0],
+                                     'report': result[1]}).encode('utf-8') +
+                         b'\n')
+
+
+class _BatchServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """_"""
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            os.unlink(path)
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _BatchHandler)
+        finally:
+            os.umask(old_umask)
+
+
+def serve(path):
+    """
+    Serve batch() on the Unix socket at path from a thread of this process,
+    with pylint imported once, and return the server.
+    """
+    # pylint: disable=import-outside-toplevel,unused-import
+    import pylint.lint
+    server = _BatchServer(path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.getLogger(__name__).debug("pylint batch: serving on %s", path)
+    return server
+
+
+def submit(path, files, pylint_rc, pylint3_rc):
+    """
+    Run batch() on the resident pylint at path.
+
+    Returns (EXIT_STATUS, REPORT), or None if nothing is listening there.
+    """
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile('rwb') as stream:
+        stream.write(json.dumps({'files': files, 'pylint_rc': pylint_rc,
+                                 'pylint3_rc': pylint3_rc,
+                                 'cwd': os.getcwd()}).encode('utf-8') + b'\n')
+        stream.flush()
+        result = json.loads(stream.readline().decode('utf-8'))
+    return result['status'], result['report']
+
+
+def main():
+    """_"""
+    parser = argparse.ArgumentParser(description='Batched pylint runner')
+    parser.add_argument('--pylint-rc', default='')
+    parser.add_argument('--pylint3-rc', default='')
+    parser.add_argument('--output', default='pylint.log')
+    parser.add_argument('--jobs', type=int, default=PYLINT_JOBS)
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    result = None
+    if PYLINT_BATCH_SOCKET:
+        result = submit(PYLINT_BATCH_SOCKET, args.files, args.pylint_rc,
+                        args.pylint3_rc)
+    if result is None:
+        try:
+            import pylint  # pylint: disable=import-outside-toplevel,unused-import
+        except ImportError:
+            print("pylint not found")
+            sys.exit(1)
+        result = batch(args.files, args.pylint_rc, args.pylint3_rc, args.jobs)
+
+    rc, report = result
+    if report:
+        with open(args.output, 'w', encoding='utf-8') as log:
+            log.write(report)
+        for line in report.splitlines(True):
+            if ':' in line:
+                sys.stdout.write(line)
+    sys.exit(rc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Review Daemon
+~~~~~~ ~~~~~~
+
+* Run reviews in resident worker processes, so a review does not pay for
+  starting Python, importing PyGithub and requests and connecting to
+  GitHub every time.
+* Keep pylint resident in each worker too: check_python.sh's pylint_batch
+  hands its run to the worker running the review (PYLINT_BATCH_SOCKET)
+  instead of importing pylint again for every review.
+* Take review jobs over a Unix socket, one JSON request per connection,
+  and stream back the job's output as it is written, a JSON line per
+  write, then its exit status:
+
+  {"env": { NAME: VALUE, ... }, "cwd": DIRECTORY}
+  {"stdout": TEXT} or {"stderr": TEXT}, ...
+  {"status": EXIT_STATUS}
+
+* github_checkpatch.py --serve runs the daemon; github_checkpatch.py with
+  REVIEW_DAEMON_SOCKET set hands its review to it.
+"""
+
+import concurrent.futures
+import contextlib
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+
+REVIEW_DAEMON_SOCKET = os.getenv('REVIEW_DAEMON_SOCKET')
+# How many reviews may run at once, each in its own worker process.
+REVIEW_DAEMON_JOBS = int(os.getenv('REVIEW_DAEMON_JOBS', '2'))
+
+# Modules whose settings are read from the environment when they are
+# imported, so are reloaded for each job.  github_api goes first so the
+# others see its new settings.
+CONFIG_MODULES = ('github_api', 'check_run', 'checker_costs',
+                  'checker_output', 'checkpatch_shards', 'lint_cache',
+                  'metrics', 'patch_stage', 'review_history',
+                  'review_matrix', 'github_checkpatch')
+
+
+# The socket of this worker's resident pylint, if it has one.
+PYLINT_SOCKET = None
+
+
+def _warm_up(path):
+    """
+    Import the reviewer once when a worker starts rather than on its first
+    job, and start its resident pylint on a socket next to the daemon's
+    at path.
+    """
+    global PYLINT_SOCKET  # pylint: disable=global-statement
+    for name in CONFIG_MODULES:
+        importlib.import_module(name)
+    pylint_batch = importlib.import_module('pylint_batch')
+    pylint_path = '%s.pylint-%d' % (path, os.getpid())
+    try:
+        pylint_batch.serve(pylint_path)
+    except (ImportError, OSError) as excpn:
+        logging.getLogger(__name__).debug("review daemon: no resident "
+                                          "pylint: %s", excpn)
+        return
+    PYLINT_SOCKET = pylint_path
+    # Worker processes skip atexit, but not multiprocessing's finalizers.
+    multiprocessing.util.Finalize(None, os.unlink, args=(pylint_path,),
+                                  exitpriority=0)
+
+
+class _QueueWriter(io.TextIOBase):
+    """
+    Text stream putting each write on a queue as (NAME, TEXT), for the
+    server to pass on to the client.
+    """
+    def __init__(self, output, name):
+        io.TextIOBase.__init__(self)
+        self.output = output
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            self.output.put((self.name, text))
+        return len(text)
+
+
+def run_job(env, cwd, output):
+    """
+    Run github_checkpatch's review in this (worker) process with the
+    environment env in the directory cwd, putting what it writes on the
+    queue output as it is written, and None when it is done.
+
+    Returns its exit status.
+    """
+    os.environ.clear()
+    os.environ.update(env)
+    if PYLINT_SOCKET:
+        os.environ['PYLINT_BATCH_SOCKET'] = PYLINT_SOCKET
+    stdout = _QueueWriter(output, 'stdout')
+    stderr = _QueueWriter(output, 'stderr')
+    handler = logging.StreamHandler(stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    status = 0
+    try:
+        # A worker runs one job at a time, and its resident pylint writes
+        # only to its own reporter, so all that is written to the
+        # process's stdout and stderr meanwhile is the job's.
+        with contextlib.redirect_stdout(stdout), \
+             contextlib.redirect_stderr(stderr):
+            try:
+                os.chdir(cwd)
+                modules = [importlib.reload(importlib.import_module(name))
+                           for name in CONFIG_MODULES]
+                modules[-1].run_review()
+            except SystemExit as excpn:
+                if excpn.code is None:
+                    status = 0
+                elif isinstance(excpn.code, int):
+                    status = excpn.code
+                else:
+                    print(excpn.code, file=sys.stderr)
+                    status = 1
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+                status = 1
+    finally:
+        root.removeHandler(handler)
+        output.put(None)
+    return status
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    """
+    Read one job from the connection, run it and stream back its output
+    and exit status.
+    """
+    def send(self, message):
+        """_"""
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        logger = logging.getLogger(__name__)
+        try:
+            job = json.loads(self.rfile.readline().decode('utf-8'))
+            env = job['env']
+            cwd = job['cwd']
+        except (ValueError, KeyError, TypeError) as excpn:
+            self.send({'stderr': 'bad review job: %s\n' % excpn})
+            status = 1
+        else:
+            logger.debug("review daemon: job in %s for change %s", cwd,
+                         env.get('CHANGE_ID'))
+            status = self.server.run(
+                env, cwd, lambda name, text: self.send({name: text}))
+            logger.debug("review daemon: job in %s exited %s", cwd, status)
+        self.send({'status': status})
+
+
+class ReviewServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """
+    Unix socket server handing each job to a pool of worker processes.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, jobs=REVIEW_DAEMON_JOBS):
+        self.jobs = max(jobs, 1)
+        self.path = path
+        context = multiprocessing.get_context('forkserver')
+        # Carries the output of the jobs from the workers as it is written.
+        self.manager = context.Manager()
+        self.executor = self._new_executor()
+        if os.path.exists(path):
+            os.unlink(path)
+        # Jobs carry GH_PASS, so only this user may connect.
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _JobHandler)
+        finally:
+            os.umask(old_umask)
+
+    def _new_executor(self):
+        """_"""
+        # Workers are started from a forkserver, not forked from this
+        # threaded server.
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.jobs, initializer=_warm_up,
+            initargs=(self.path,),
+            mp_context=multiprocessing.get_context('forkserver'))
+
+    def run(self, env, cwd, send):
+        """
+        Run a job in a worker, passing what it writes to send(NAME, TEXT)
+        as it is written, and replacing the pool if a worker died.
+
+        Returns its exit status.
+        """
+        executor = self.executor
+        output = self.manager.Queue()
+        future = executor.submit(run_job, env, cwd, output)
+        while True:
+            try:
+                item = output.get(timeout=1)
+            except queue.Empty:
+                if future.done():
+                    break
+                continue
+            if item is None:
+                break
+            send(*item)
+        try:
+            return future.result()
+        except concurrent.futures.process.BrokenProcessPool as excpn:
+            if self.executor is executor:
+                self.executor = self._new_executor()
+            send('stderr', 'review worker died: %s\n' % excpn)
+            return 1
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def serve(path=None, jobs=REVIEW_DAEMON_JOBS):
+    """
+    Serve review jobs on the Unix socket at path (REVIEW_DAEMON_SOCKET by
+    default) until interrupted.
+    """
+    path = path or REVIEW_DAEMON_SOCKET
+    if not path:
+        print("No socket given to serve review jobs on; set "
+              "REVIEW_DAEMON_SOCKET or pass one to --serve.")
+        sys.exit(2)
+    # Shut down cleanly when stopped by a service manager too.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server = ReviewServer(path, jobs)
+    logging.getLogger(__name__).debug("review daemon: serving on %s with %d "
+                                      "workers", path, server.jobs)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(wait=True)
+        server.manager.shutdown()
+
+
+def submit(path, env, cwd):
+    """
+    Hand a review job to the daemon at path and copy its output to
+    stdout and stderr as it comes.
+
+    Returns its exit status, or None if there is no daemon to take it.
+    """
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    except OSError as excpn:
+        logging.getLogger(__name__).debug("review daemon: can not connect "
+                                          "to %s: %s", path, excpn)
+        sock.close()
+        return None
+    with sock, sock.makefile('rwb') as stream:
+        stream.write(json.dumps({'env': env, 'cwd': cwd}).encode('utf-8') +
+                     b'\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line.decode('utf-8'))
+            if 'status' in message:
+                return message['status']
+            for name, text in message.items():
+                output = sys.stdout if name == 'stdout' else sys.stderr
+                output.write(text)
+                output.flush()
+    print("review daemon closed the connection before the review finished",
+          file=sys.stderr)
+    return 1
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Review History
+~~~~~~ ~~~~~~~
+
+* Record the per file checker results of the last reviewed revision of
+  each pull request, one file per pull request in REVIEW_HISTORY_PATH.d.
+* Carry those results forward to the next revision for the files that
+  did not change in between.
+"""
+
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+
+import lint_cache
+
+# Characters of a change id that may not be in a record's file name.
+UNSAFE_NAME_RE = re.compile(r'[^A-Za-z0-9._-]')
+
+# The umask, to give the records that mkstemp() makes 0600 the mode open()
+# would, for jobs running as other users.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def changed_files(old, new, repo='.'):
+    """
+    The set of paths that differ between commits old and new, or None if
+    that can not be worked out, e.g. old is not in the checkout any more
+    after a force push.
+    """
+    cmd = ['git', 'diff', '--name-only', '--no-renames', '-z', old, new]
+    try:
+        out = subprocess.check_output(cmd, cwd=repo,
+                                      stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return set(path for path in out.decode('utf-8', 'replace').split('\0')
+               if path)
+
+
+class ReviewHistory(object):
+    """
+    REVIEW_HISTORY_PATH.d/CHANGE_ID.json holds the record of the last
+    reviewed revision of each change, replaced by the next:
+
+    {"change": CHANGE_ID, "commit": SHA,
+     "checkers": { CONFIG_KEY: { PATH: { LINE: [[LEVEL, COMMENT], ...] }
+                                 } } }
+
+    CONFIG_KEY is the LintCache.config_key() of the checker, so results
+    are only reused while the checker and its configuration are the same.
+    Every file given to a checker has an entry, even if it is empty, but
+    for those with comments that depend on other files.
+    """
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.records = path + '.d'
+
+    def _record_path(self, change_id):
+        """_"""
+        return os.path.join(self.records, '%s.json' %
+                            UNSAFE_NAME_RE.sub('_', str(change_id)))
+
+    def last_review(self, change_id):
+        """
+        Return the most recent record for change_id, or None.
+        """
+        try:
+            with open(self._record_path(change_id),
+                      encoding='utf-8') as record:
+                last = json.load(record)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(last, dict) or \
+           last.get('change') != str(change_id):
+            return None
+        return last
+
+    def carry_forward(self, change_id, commit, files, config_keys, repo='.'):
+        """
+        Results from the last review of change_id for the files that have
+        not changed since, for each checker in config_keys
+        ({ CHECKER: CONFIG_KEY }).
+
+        An unchanged file's lines are where they were, so its comments are
+        reused as they are.
+
+        Returns { CHECKER: { PATH: { LINE: [[LEVEL, COMMENT], ...] } } }.
+        """
+        last = self.last_review(change_id)
+        if not last:
+            return {}
+        changed = changed_files(last['commit'], commit, repo)
+        if changed is None:
+            self.logger.debug("review history: can not diff %s..%s",
+                              last['commit'], commit)
+            return {}
+        carried = {}
+        for checker, config_key in config_keys.items():
+            prior = last['checkers'].get(config_key)
+            if not prior:
+                continue
+            carried[checker] = {
+                path: {int(line): comments
+                       for line, comments in line_comments.items()}
+                for path, line_comments in prior.items()
+                if path in files and path not in changed}
+        self.logger.debug("review history: %s..%s changed %d files",
+                          last['commit'], commit, len(changed))
+        return carried
+
+    def record(self, change_id, commit, checkers):
+        """
+        Atomically replace the record of change_id with the results of
+        reviewing commit, where checkers is
+        { CONFIG_KEY: { PATH: { LINE: [[LEVEL, COMMENT], ...] } } }.
+
+        A file with comments that depend on other files
+        (lint_cache.CONTEXT_COMMENT_RE) is left out, to be checked again
+        next time rather than carried forward.
+        """
+        checkers = {
+            config_key: {
+                path: line_comments
+                for path, line_comments in results.items()
+                if not any(lint_cache.CONTEXT_COMMENT_RE.search(comment)
+                           for comments in line_comments.values()
+                           for _, comment in comments)}
+            for config_key, results in checkers.items()}
+        try:
+            os.makedirs(self.records, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.records, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as record:
+                    json.dump({'change': str(change_id), 'commit': commit,
+                               'checkers': checkers}, record)
+                os.chmod(tmp_path, 0o666 & ~UMASK)
+                os.replace(tmp_path, self._record_path(change_id))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as excpn:
+            self.logger.debug("review history: could not record %s: %s",
+                              commit, excpn)
+
+
+def open_history():
+    """
+    Return the ReviewHistory at REVIEW_HISTORY_PATH, or None if it is not
+    set.
+    """
+    path = os.getenv('REVIEW_HISTORY_PATH')
+    if not path:
+        return None
+    return ReviewHistory(path)
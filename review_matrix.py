@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Matrix Review Aggregation
+~~~~~~ ~~~~~~ ~~~~~~~~~~~
+
+* Have each leg of a matrix build (one per distro) write the comments its
+  checkers made to REVIEW_MATRIX_DIR/<LEG>.json instead of posting its own
+  review.
+* Merge the comments of every leg, each distinct (path, line, message)
+  once, tagged with the legs it was found on, for one combined review.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+import comment_store
+
+REVIEW_MATRIX_DIR = os.getenv('REVIEW_MATRIX_DIR')
+# The name of this leg of the matrix, the distro it builds on by default.
+REVIEW_MATRIX_LEG = os.getenv('REVIEW_MATRIX_LEG', os.getenv('distro'))
+# Set for the final step that posts the merged review of all of the legs.
+REVIEW_MATRIX_MERGE = os.getenv('REVIEW_MATRIX_MERGE', 'false') == 'true'
+
+LEG_SUFFIX = '.json'
+
+# The umask, to give the legs that mkstemp() makes 0600 the mode open()
+# would, for a merge step running as another user.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def is_leg():
+    """True if this run is a matrix leg that only records its comments"""
+    return bool(REVIEW_MATRIX_DIR and REVIEW_MATRIX_LEG and
+                not REVIEW_MATRIX_MERGE)
+
+
+def is_merge():
+    """True if this run posts the merged review of the matrix legs"""
+    return bool(REVIEW_MATRIX_DIR and REVIEW_MATRIX_MERGE)
+
+
+def write_leg(store, commit=None, matrix_dir=None, leg=None):
+    """
+    Atomically write the comments in store, a CommentStore, as the
+    results of leg for commit.
+    """
+    matrix_dir = matrix_dir or REVIEW_MATRIX_DIR
+    leg = leg or REVIEW_MATRIX_LEG
+    os.makedirs(matrix_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=matrix_dir, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            json.dump({'leg': leg, 'commit': commit,
+                       'comments': store.as_dict()}, out)
+        os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, os.path.join(matrix_dir, leg + LEG_SUFFIX))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_legs(commit=None, matrix_dir=None):
+    """
+    The results written by each leg in matrix_dir, skipping any left
+    there from a review of some commit other than commit.
+
+    Returns { LEG: { PATH: { LINE: [[LEVEL, COMMENT], ...] } } }.
+    """
+    logger = logging.getLogger(__name__)
+    matrix_dir = matrix_dir or REVIEW_MATRIX_DIR
+    legs = {}
+    try:
+        names = sorted(os.listdir(matrix_dir))
+    except OSError as excpn:
+        logger.debug("review matrix: can not list %s: %s", matrix_dir, excpn)
+        return legs
+    for name in names:
+        if not name.endswith(LEG_SUFFIX) or name.startswith('.'):
+            continue
+        try:
+            with open(os.path.join(matrix_dir, name), encoding='utf-8') as leg:
+                data = json.load(leg)
+        except (IOError, OSError, ValueError) as excpn:
+            logger.debug("review matrix: skipping %s: %s", name, excpn)
+            continue
+        if commit and data.get('commit') and data['commit'] != commit:
+            logger.debug("review matrix: skipping %s, for commit %s",
+                         name, data['commit'])
+            continue
+        legs[data.get('leg') or name[:-len(LEG_SUFFIX)]] = {
+            path: {int(line): comments for line, comments in lines.items()}
+            for path, lines in data.get('comments', {}).items()}
+    return legs
+
+
+def merge_legs(legs, files):
+    """
+    Merge the results of the legs from load_legs() into one CommentStore,
+    with each distinct comment on a line once, at the level of the first
+    leg it was found on, and followed by the legs it was found on, e.g.
+    "(BRACES) ... [el7, el8]".
+
+    Returns that and the [count] of comments on paths in files.
+    """
+    # { (PATH, LINE, COMMENT): (LEVEL, [LEG, ...]) }
+    found = {}
+    for leg in sorted(legs):
+        for path, line_comments in legs[leg].items():
+            for line, comments in line_comments.items():
+                for level, comment in comments:
+                    _, comment_legs = found.setdefault((path, line, comment),
+                                                       (level, []))
+                    if leg not in comment_legs:
+                        comment_legs.append(leg)
+
+    store = comment_store.CommentStore()
+    warning_count = [0]
+    for (path, line, comment), (level, comment_legs) in found.items():
+        tagged = '%s [%s]' % (comment, ', '.join(comment_legs))
+        if store.add(path, line, tagged, level) and path in files:
+            warning_count[0] += 1
+    return store, warning_count
@@ -29,6 +29,10 @@ if [ ! -d "${PROJECT_REPO}" ]; then
   fi
 fi
 
+# SHELLCHECK_FORMAT=json1 gives the reviewer output it can parse without
+# guessing, people running the commit hook get the gcc format.
+: "${SHELLCHECK_FORMAT:="gcc"}"
+
 # Follow external references if shellcheck supports it.
 external=
 if (shellcheck --help | grep "\-\-external") &> /dev/null; then
@@ -46,11 +50,24 @@ pushd "${PROJECT_REPO}" > /dev/null || exit 1
     file_list=${file_list1//$'\n'/ }
   fi
 
-  for script_file in ${file_list}; do
-    if file "$script_file" | grep -q -e 'shell script'; then
-      if ! shellcheck ${external} --format=gcc "${script_file}"; then
-        (( rc=rc+PIPESTATUS[0] ))
+  # The reviewer picks out the shell scripts in FILELIST_SHELL_FILE (NUL
+  # separated) and FILELIST_SHELL.
+  if [ -n "${FILELIST_SHELL_FILE-}" ]; then
+    mapfile -d '' script_list < "${FILELIST_SHELL_FILE}"
+  elif [ -n "${FILELIST_SHELL+set}" ]; then
+    read -r -a script_list <<< "${FILELIST_SHELL}"
+  else
+    script_list=()
+    for script_file in ${file_list}; do
+      if file "$script_file" | grep -q -e 'shell script'; then
+        script_list+=("${script_file}")
       fi
+    done
+  fi
+
+  for script_file in "${script_list[@]}"; do
+    if ! shellcheck ${external} --format="${SHELLCHECK_FORMAT}" "${script_file}"; then
+      (( rc=rc+PIPESTATUS[0] ))
     fi
   done
 popd > /dev/null || exit 1
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Staged File Lint
+~~~~~~ ~~~~ ~~~~
+
+* Lint only the files staged for the next commit, as a pre-commit hook,
+  with their contents read from the index rather than the working tree.
+* Reuse the lint cache, keyed by blob SHA, so that a file is only linted
+  again when what is staged of it changes.  It is kept in the git
+  directory unless LINT_CACHE_DIR or REVIEW_HISTORY_BASE say otherwise.
+* Run the checkers that have files left to lint concurrently, in the
+  working tree when it matches the index, so that what the staged files
+  import or source is there as it will be committed.  Otherwise they run
+  on a copy of the staged files and the rest of the index in their
+  directories.
+
+usage: staged_lint.py CHECKER...
+
+Prints each comment as PATH:LINE: COMMENT and exits 1 if there are any.
+"""
+
+import concurrent.futures
+import os
+import stat
+import subprocess
+import sys
+
+import checker_output
+import comment_store
+import file_types
+import lint_cache
+import patch_stage
+
+# How many checkers may run at once.
+STAGED_LINT_JOBS = int(os.getenv('STAGED_LINT_JOBS',
+                                 str(os.cpu_count() or 1)))
+
+# Modes of index entries that are not linted: symbolic links and
+# submodules.
+SKIPPED_MODES = (stat.S_IFLNK, 0o160000)
+
+
+def _git(repo, *args, **kwargs):
+    """The output of git args in repo, as bytes"""
+    return subprocess.check_output(('git',) + args, cwd=repo,
+                                   stderr=subprocess.DEVNULL, **kwargs)
+
+
+def staged_files(repo='.'):
+    """
+    The files added, copied or modified in the index against HEAD (or
+    against nothing before the first commit).
+
+    Returns { PATH: (MODE, BLOB_SHA) }.
+    """
+    try:
+        base = _git(repo, 'rev-parse', '--verify', '--quiet', 'HEAD')
+    except subprocess.CalledProcessError:
+        base = _git(repo, 'hash-object', '-t', 'tree', '/dev/null')
+    out = _git(repo, 'diff-index', '--cached', '-z', '--no-renames',
+               '--diff-filter=ACM', base.decode('ascii').strip())
+    fields = out.split(b'\0')
+    files = {}
+    for meta, path in zip(fields[0::2], fields[1::2]):
+        # :OLD_MODE NEW_MODE OLD_SHA NEW_SHA STATUS
+        _, mode, _, sha, _ = meta.decode('ascii').split(' ')
+        mode = int(mode, 8)
+        if stat.S_IFMT(mode) in SKIPPED_MODES or mode in SKIPPED_MODES:
+            continue
+        files[os.fsdecode(path)] = (mode, sha)
+    return files
+
+
+def staged_config_files(repo='.'):
+    """
+    The first staged file of each of lint_cache.CONFIG_FILE_NAMES.
+
+    Returns { PATH: (MODE, BLOB_SHA) }.
+    """
+    out = _git(repo, 'ls-files', '-s', '-z', '--',
+               *('*' + name for name in lint_cache.CONFIG_FILE_NAMES))
+    found = {}
+    files = {}
+    for entry in out.split(b'\0'):
+        if not entry:
+            continue
+        # MODE SHA STAGE\tPATH
+        meta, path = entry.split(b'\t', 1)
+        mode, sha, _ = meta.decode('ascii').split(' ')
+        path = os.fsdecode(path)
+        name = os.path.basename(path)
+        if name in lint_cache.CONFIG_FILE_NAMES and name not in found:
+            found[name] = path
+            files[path] = (int(mode, 8), sha)
+    return files
+
+
+def write_blobs(files, tree, repo='.'):
+    """
+    Write the blob of each of files ({ PATH: (MODE, BLOB_SHA) }) to PATH
+    under tree, read with a single git cat-file --batch.
+    """
+    if not files:
+        return
+    paths = list(files)
+    out = _git(repo, 'cat-file', '--batch',
+               input=''.join(files[path][1] + '\n'
+                             for path in paths).encode('ascii'))
+    pos = 0
+    for path in paths:
+        end = out.index(b'\n', pos)
+        header = out[pos:end].split()
+        pos = end + 1
+        if len(header) != 3:
+            # missing
+            continue
+        size = int(header[2])
+        target = os.path.join(tree, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as blob:
+            blob.write(out[pos:pos + size])
+        os.chmod(target, files[path][0] & 0o777)
+        pos += size + 1
+
+
+def worktree_matches(repo='.'):
+    """
+    True if the tracked files in the working tree of repo are as they are
+    in the index, so that the staged files can be linted where they are.
+    """
+    return subprocess.call(['git', 'diff', '--quiet'], cwd=repo,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL) == 0
+
+
+def context_files(paths, repo='.'):
+    """
+    The files in the index in the same directories as paths, for what
+    those import or source from around them.
+
+    Returns { PATH: (MODE, BLOB_SHA) }.
+    """
+    dirs = sorted(set(os.path.dirname(path) for path in paths))
+    out = _git(repo, 'ls-files', '-s', '-z', '--full-name', '--',
+               *(':(top,glob)%s*' % (dirname + '/' if dirname else '')
+                 for dirname in dirs))
+    files = {}
+    for entry in out.split(b'\0'):
+        if not entry:
+            continue
+        # MODE SHA STAGE\tPATH
+        meta, path = entry.split(b'\t', 1)
+        mode, sha, _ = meta.decode('ascii').split(' ')
+        mode = int(mode, 8)
+        if stat.S_IFMT(mode) in SKIPPED_MODES or mode in SKIPPED_MODES:
+            continue
+        files[os.fsdecode(path)] = (mode, sha)
+    return files
+
+
+def _cache_dir(repo='.'):
+    """
+    Where the lint cache goes when neither LINT_CACHE_DIR nor
+    REVIEW_HISTORY_BASE is set: lint_cache in the (common) git directory.
+    """
+    git_dir = _git(repo, 'rev-parse', '--git-common-dir').decode(
+        'utf-8').strip()
+    return os.path.join(os.path.abspath(os.path.join(repo, git_dir)),
+                        'lint_cache')
+
+
+def run_checker(path, env, files, tree):
+    """
+    Run the checker at path on files under tree and return its exit
+    status, stderr and comments, a CommentStore.
+    """
+    with subprocess.Popen([path], cwd=tree, env=env,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE) as pipe:
+        out, err = pipe.communicate()
+    comments = comment_store.CommentStore()
+    checker_output.parse_checkpatch_output(
+        out.decode('utf-8', 'replace'), comments, [0], set(files),
+        checker_output.checker_format(path))
+    return pipe.returncode, err, comments
+
+
+def lint(checkers, repo='.'):
+    """
+    Lint what is staged in repo with checkers.
+
+    Returns (COMMENTS, FAILED), a CommentStore of the comments on the
+    staged files and the checkers that failed without saying why.
+    """
+    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    files = staged_files(repo)
+    store = comment_store.CommentStore()
+    if not files:
+        return store, []
+    failed = []
+    with patch_stage.PatchStage(b'') as stage:
+        in_worktree = worktree_matches(repo)
+        if in_worktree:
+            tree = _git(repo, 'rev-parse', '--show-toplevel').decode(
+                'utf-8').strip()
+        else:
+            tree = os.path.join(stage.path, 'tree')
+            write_blobs(staged_config_files(repo), tree, repo)
+
+        if not os.getenv('LINT_CACHE_DIR') and \
+           not os.getenv('REVIEW_HISTORY_BASE') and \
+           not os.getenv('REVIEW_HISTORY_PATH'):
+            os.environ['LINT_CACHE_DIR'] = _cache_dir(repo)
+        cache = lint_cache.open_cache(
+            tree, [], checker_output.CHECKPATCH_IGNORED_KINDS +
+            checker_output.CHECKPATCH_IGNORED_FILES)
+        shas = {path: sha for path, (_, sha) in files.items()}
+
+        # Only the files whose types are not remembered need be read.
+        types_memo = file_types.open_file_types(cache.path)
+        if not in_worktree:
+            write_blobs({path: entry for path, entry in files.items()
+                         if '%s %s' % (entry[1], os.path.splitext(path)[1])
+                         not in types_memo.memo}, tree, repo)
+        types = types_memo.classify(sorted(files), tree, shas)
+        types_memo.save()
+
+        # { CHECKER: [PATH, ...] } of the files each checker has to lint.
+        todo = {}
+        for checker in checkers:
+            wanted = checker_output.CHECKER_FILE_TYPES.get(
+                os.path.basename(checker))
+            lint_files = [path for path in sorted(files)
+                          if not wanted or types.get(path) in wanted]
+            if cache.cacheable(checker):
+                misses = []
+                for path in lint_files:
+                    line_comments = cache.get(cache.key(checker, shas[path]))
+                    if line_comments is None:
+                        misses.append(path)
+                    else:
+                        store.add_line_comments(path, line_comments)
+                lint_files = misses
+            if lint_files:
+                todo[checker] = lint_files
+
+        # Checked alone, pylint and shellcheck can not follow imports and
+        # sources to the files around them, so those are copied too.
+        if todo and not in_worktree:
+            write_blobs(context_files(set().union(*todo.values()), repo),
+                        tree, repo)
+
+        def check(checker):
+            """_"""
+            lint_files = todo[checker]
+            env = dict(os.environ, PROJECT_REPO=tree,
+                       FILELIST=' '.join(lint_files),
+                       PYLINT_OUT=os.path.join(
+                           stage.path, os.path.basename(checker) + '.log'),
+                       **checker_output.FORMAT_ENV.get(
+                           checker_output.checker_format(checker), {}))
+            env.update(file_types.file_lists(types, lint_files))
+            env.update(stage.env(lint_files, types))
+            return run_checker(checker, env, lint_files, tree)
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(STAGED_LINT_JOBS, 1)) as executor:
+            results = dict(zip(todo, executor.map(check, todo)))
+        for checker in checkers:
+            if checker not in results:
+                continue
+            returncode, err, comments = results[checker]
+            if returncode and not comments:
+                failed.append((checker, returncode, err))
+            elif cache.cacheable(checker):
+                for path in todo[checker]:
+                    cache.put(cache.key(checker, shas[path]),
+                              comments.line_comments(path))
+            for path, line, level, kind, comment in comments:
+                store.add(path, line, comment, level, kind)
+        cache.evict()
+    return store, failed
+
+
+def main():
+    """_"""
+    if len(sys.argv) < 2:
+        print('usage: staged_lint.py CHECKER...', file=sys.stderr)
+        sys.exit(2)
+    checkers = [os.path.abspath(checker) for checker in sys.argv[1:]]
+    store, failed = lint(checkers, os.getenv('PROJECT_REPO', '.'))
+    for path in sorted(store.paths()):
+        for line, comments in sorted(store.path_lines(path)):
+            for comment in comments:
+                print('%s:%d: %s' % (path, line, comment))
+    for checker, returncode, err in failed:
+        print('%s failed with exit status %d:\n%s' %
+              (os.path.basename(checker), returncode,
+               err.decode('utf-8', 'replace')), file=sys.stderr)
+    sys.exit(1 if len(store) or failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Review Pipeline Benchmark
+~~~~~~ ~~~~~~~~ ~~~~~~~~~
+
+* Generate synthetic patches, checker output and formatter diffs for
+  pull requests of each size in SCALES.
+* Time parse_checkpatch_output, review_input_and_score,
+  add_patch_linenos, diff_suggestions (the hunk parsing of
+  Reviewer.run_from_diff) and Reviewer.create_github_review separately,
+  best of --repeat runs, and measure the peak memory each one allocates.
+* Compare the results with the baseline stored in benchmark_baseline.json
+  and exit 1 if any stage is slower or bigger than the thresholds allow,
+  or with --save store them as the new baseline.
+
+usage: benchmark.py [--scale NAME]... [--repeat N] [--save]
+                    [--time-threshold RATIO] [--memory-threshold RATIO]
+
+Timings depend on the machine, so a baseline is only meaningful on the
+kind of machine it was saved on.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+
+# pylint: disable=wrong-import-position
+import checker_output
+import comment_store
+import github_checkpatch
+
+BASELINE_PATH = os.path.join(TEST_DIR, 'benchmark_baseline.json')
+
+# NAME: (FILES, WARNINGS)
+SCALES = {
+    'small': (10, 1000),
+    'medium': (1000, 100000),
+    'large': (10000, 1000000),
+    'huge': (50000, 5000000),
+}
+DEFAULT_SCALES = ('small', 'medium')
+
+STAGES = ('parse_checkpatch_output', 'review_input_and_score',
+          'add_patch_linenos', 'diff_suggestions', 'create_github_review')
+
+# Lines in each synthetic file, and the hunks the patch makes in it.
+FILE_LINES = 400
+HUNKS = 4
+HUNK_ADDED = 5
+# How many times each distinct diagnostic is repeated.
+REPEATS = 3
+
+# A regression is only reported if a stage is also this many seconds
+# slower, so that the smallest timings do not fail on noise.
+MIN_SECONDS = 0.005
+
+MESSAGES = (
+    "warning: unused variable 'rc' [-Wunused-variable]",
+    "warning: comparison of integer expressions of different signedness "
+    "[-Wsign-compare]",
+    "warning: implicit declaration of function 'foo' "
+    "[-Wimplicit-function-declaration]",
+    "warning: 'len' may be used uninitialized [-Wmaybe-uninitialized]",
+    "error: expected ';' before '}' token",
+    "warning: unused parameter 'arg' [-Wunused-parameter]",
+    "note: in expansion of macro 'D_ASSERT'",
+)
+
+
+def make_files(count):
+    """count synthetic source paths"""
+    return ['src/mod%d/file%d.c' % (index % 97, index)
+            for index in range(count)]
+
+
+def _hunk_starts():
+    """The first line of each of the HUNKS hunks in a file"""
+    return [1 + index * (FILE_LINES // HUNKS) for index in range(HUNKS)]
+
+
+def make_patch(files):
+    """A unified diff making HUNKS hunks in each of files"""
+    out = []
+    for path in files:
+        out.append('diff --git a/%s b/%s' % (path, path))
+        out.append('--- a/%s' % path)
+        out.append('+++ b/%s' % path)
+        for start in _hunk_starts():
+            out.append('@@ -%d,3 +%d,%d @@ static int func(void)' %
+                       (start, start, 3 + HUNK_ADDED))
+            out.append(' \tint rc;')
+            out.extend('+\trc = call_%d();' % line
+                       for line in range(HUNK_ADDED))
+            out.append(' ')
+            out.append(' \treturn rc;')
+    return '\n'.join(out) + '\n'
+
+
+def make_warnings(files, count):
+    """
+    count gcc style diagnostics spread over files, each one REPEATS times
+    as a diagnostic in a header is by each compile unit including it.
+    """
+    nfiles = len(files)
+    warnings = []
+    for index in range(count):
+        # Which of the distinct diagnostics for the file this is.
+        which = index // nfiles // REPEATS
+        warnings.append('%s:%d:%d: %s' % (files[index % nfiles],
+                                          (which * 7919) % FILE_LINES + 1,
+                                          which % 40 + 1,
+                                          MESSAGES[which % len(MESSAGES)]))
+    return warnings
+
+
+def make_suggestion_diff(files):
+    """A git diff -U1 of a formatter changing each of files"""
+    out = []
+    for path in files:
+        out.append('diff --git a/%s b/%s' % (path, path))
+        out.append('index 0123456..89abcde 100644')
+        out.append('--- a/%s' % path)
+        out.append('+++ b/%s' % path)
+        for start in _hunk_starts():
+            out.append('@@ -%d,4 +%d,4 @@' % (start, start))
+            out.append(' {')
+            out.append('-\tif(rc)')
+            out.append('-\t\treturn rc ;')
+            out.append('+\tif (rc)')
+            out.append('+\t\treturn rc;')
+            out.append(' }')
+    return '\n'.join(out) + '\n'
+
+
+def make_reviewer():
+    """A Reviewer for create_github_review that has not connected"""
+    reviewer = github_checkpatch.Reviewer.__new__(github_checkpatch.Reviewer)
+    reviewer.project = 'daos-stack'
+    reviewer.repo = 'bench'
+    return reviewer
+
+
+def run_stages(inputs, measure):
+    """
+    Run each of STAGES once on inputs, with measure(STAGE, FUNC) running
+    FUNC() for STAGE and returning its result.
+    """
+    files, patch, warnings, suggestion_diff, reviewer = inputs
+    file_set = set(files)
+
+    def parse():
+        """_"""
+        store = comment_store.CommentStore()
+        warning_count = [0]
+        checker_output.parse_checkpatch_output(warnings, store,
+                                               warning_count, file_set,
+                                               'gcc')
+        return store, warning_count
+
+    store, warning_count = measure('parse_checkpatch_output', parse)
+    review_input, _ = measure(
+        'review_input_and_score',
+        lambda: github_checkpatch.review_input_and_score(store,
+                                                         warning_count))
+    review_input['files'] = file_set
+    measure('add_patch_linenos',
+            lambda: github_checkpatch.add_patch_linenos(review_input, patch))
+    measure('diff_suggestions',
+            lambda: github_checkpatch.diff_suggestions(suggestion_diff))
+    measure('create_github_review',
+            lambda: reviewer.create_github_review(review_input, '0' * 40))
+
+
+def benchmark(scale, repeat):
+    """
+    Time and measure each stage at scale.
+
+    Returns { STAGE: { 'seconds': BEST, 'peak_bytes': PEAK } }.
+    """
+    nfiles, nwarnings = SCALES[scale]
+    files = make_files(nfiles)
+    inputs = (files, make_patch(files), make_warnings(files, nwarnings),
+              make_suggestion_diff(files), make_reviewer())
+    results = {stage: {'seconds': None, 'peak_bytes': 0} for stage in STAGES}
+
+    def timed(stage, func):
+        """_"""
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        best = results[stage]['seconds']
+        if best is None or seconds < best:
+            results[stage]['seconds'] = seconds
+        return value
+
+    def traced(stage, func):
+        """_"""
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        value = func()
+        results[stage]['peak_bytes'] = \
+            tracemalloc.get_traced_memory()[1] - before
+        return value
+
+    for _ in range(repeat):
+        run_stages(inputs, timed)
+    # Memory is traced in a run of its own, as tracing slows everything.
+    tracemalloc.start()
+    try:
+        run_stages(inputs, traced)
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """
+    The regressions of results against baseline, both
+    { SCALE: { STAGE: { 'seconds': ..., 'peak_bytes': ... } } }.
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if not base:
+                continue
+            if result['seconds'] > base['seconds'] * time_threshold and \
+               result['seconds'] - base['seconds'] > MIN_SECONDS:
+                regressions.append('%s %s: %.4fs, baseline %.4fs' %
+                                   (scale, stage, result['seconds'],
+                                    base['seconds']))
+            if result['peak_bytes'] > base['peak_bytes'] * memory_threshold:
+                regressions.append('%s %s: peak %d bytes, baseline %d' %
+                                   (scale, stage, result['peak_bytes'],
+                                    base['peak_bytes']))
+    return regressions
+
+
+def main():
+    """_"""
+    parser = argparse.ArgumentParser(description='Review pipeline benchmark')
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the baseline')
+    parser.add_argument('--time-threshold', type=float, default=1.5)
+    parser.add_argument('--memory-threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    except (IOError, OSError, ValueError):
+        baseline = {}
+
+    os.environ.setdefault('GIT_COMMIT', '0' * 40)
+    results = {}
+    for scale in args.scale or DEFAULT_SCALES:
+        results[scale] = benchmark(scale, max(args.repeat, 1))
+        for stage in STAGES:
+            result = results[scale][stage]
+            base = baseline.get(scale, {}).get(stage)
+            print('%-6s %-24s %9.4fs %12d bytes%s' %
+                  (scale, stage, result['seconds'], result['peak_bytes'],
+                   '  (baseline %.4fs %d bytes)' %
+                   (base['seconds'], base['peak_bytes']) if base else ''))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        return
+
+    regressions = compare(results, baseline, args.time_threshold,
+                          args.memory_threshold)
+    for regression in regressions:
+        print('REGRESSION: %s' % regression)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
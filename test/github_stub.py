@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+GitHub API Stub
+~~~~~~ ~~~ ~~~~
+
+* Serve canned JSON responses for the REST endpoints a test sets up, on
+  a local port, for a github.Github to be pointed at.
+* Answer a GET with a 304 when its If-None-Match is the ETag of the
+  response, as GitHub does for conditional requests.
+* Record every request made, with its If-None-Match and JSON body, for
+  the test to check.
+"""
+
+import http.server
+import json
+import threading
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """_"""
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _reply(self, status, data=None, etag=None):
+        """_"""
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-RateLimit-Remaining', '4999')
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Reset', '9999999999')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        """_"""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        path = self.path.split('?')[0]
+        if_none_match = self.headers.get('If-None-Match')
+        self.server.stub.requests.append((method, path, if_none_match, body))
+        route = self.server.stub.routes.get((method, path))
+        if route is None:
+            self._reply(404, {'message': 'Not Found'})
+            return
+        status, data, etag = route
+        if method == 'GET' and etag and if_none_match == etag:
+            self._reply(304, etag=etag)
+        else:
+            self._reply(status, data, etag)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """_"""
+        self._handle('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """_"""
+        self._handle('POST')
+
+    def do_PATCH(self):  # pylint: disable=invalid-name
+        """_"""
+        self._handle('PATCH')
+
+
+class GithubStub(object):
+    """
+    A stub GitHub API server, running in a thread between start() and
+    stop(), or while used as a context manager.  self.url is its base URL.
+    """
+    def __init__(self):
+        # { (METHOD, PATH): (STATUS, DATA, ETAG) }
+        self.routes = {}
+        # [(METHOD, PATH, IF_NONE_MATCH, BODY)]
+        self.requests = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      _Handler)
+        self.server.stub = self
+        self.url = 'http://%s:%d' % self.server.server_address
+        self.thread = None
+
+    def route(self, method, path, data, status=200, etag=None):
+        """Answer method requests of path with status and data"""
+        self.routes[(method, path)] = (status, data, etag)
+
+    def start(self):
+        """Serve requests in a thread until stop()"""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.05},
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """_"""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
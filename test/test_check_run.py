@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Check Run Test
+~~~~~ ~~~ ~~~~
+
+* Post check runs with more annotations than fit in one request to a
+  GithubStub, and check that the run is created with the first
+  CHECK_RUN_ANNOTATIONS of them and updated with the rest, completed
+  only by the last update.
+* Check that a run with no more annotations than fit in one request is
+  created completed.
+
+usage: test_check_run.py
+"""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+
+# pylint: disable=wrong-import-position
+import check_run
+import github_api
+import github_stub
+
+CHECK_RUNS = '/repos/daos-stack/code_review/check-runs'
+SHA = 'f' * 40
+
+
+class CheckRunTest(unittest.TestCase):
+    """CheckRun.post() against a GithubStub"""
+
+    def setUp(self):
+        self.stub = github_stub.GithubStub()
+        self.stub.route('POST', CHECK_RUNS, {'id': 7}, status=201)
+        self.stub.route('PATCH', CHECK_RUNS + '/7', {'id': 7})
+        self.stub.start()
+        self.client = github_api.GithubClient(
+            github_api.connect('user', 'password', self.stub.url))
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def post(self, count):
+        """Post a run with count annotations, returning post()'s result"""
+        annotations = [{'path': 'a.py', 'start_line': line,
+                        'end_line': line, 'annotation_level': 'warning',
+                        'message': 'comment %d' % line}
+                       for line in range(1, count + 1)]
+        run = check_run.CheckRun(self.client, 'daos-stack', 'code_review',
+                                 SHA)
+        return run.post('title', 'summary', annotations, 'neutral')
+
+    def test_batches(self):
+        """A POST of the first 50 annotations, then PATCHes of the rest"""
+        self.assertEqual(self.post(120), 3)
+        self.assertEqual([(method, path, len(body['output']['annotations']))
+                          for method, path, _, body in self.stub.requests],
+                         [('POST', CHECK_RUNS, 50),
+                          ('PATCH', CHECK_RUNS + '/7', 50),
+                          ('PATCH', CHECK_RUNS + '/7', 20)])
+        first, second, last = [body for _, _, _, body in self.stub.requests]
+        self.assertEqual(first['status'], 'in_progress')
+        self.assertEqual(first['head_sha'], SHA)
+        self.assertEqual(first['output']['annotations'][0]['start_line'], 1)
+        self.assertNotIn('status', second)
+        self.assertEqual(second['output']['annotations'][0]['start_line'],
+                         51)
+        self.assertEqual(last['status'], 'completed')
+        self.assertEqual(last['conclusion'], 'neutral')
+        self.assertEqual(last['output']['annotations'][-1]['start_line'],
+                         120)
+        self.assertEqual(self.client.sent, {'POST': 1, 'PATCH': 2})
+
+    def test_single_request(self):
+        """A run that fits in one request is created completed"""
+        self.assertEqual(self.post(check_run.CHECK_RUN_ANNOTATIONS), 1)
+        self.assertEqual(len(self.stub.requests), 1)
+        method, _, _, body = self.stub.requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertEqual(body['status'], 'completed')
+        self.assertEqual(len(body['output']['annotations']),
+                         check_run.CHECK_RUN_ANNOTATIONS)
+
+
+if __name__ == '__main__':
+    unittest.main()
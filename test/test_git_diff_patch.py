@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+Local Patch Test
+~~~~~ ~~~~~ ~~~~
+
+* Build a throwaway git repository with a base branch and a feature
+  branch that forks from it, then moves on past the fork.
+* Check that git_diff_patch() gives the diff of the feature branch from
+  the merge-base, as GitHub serves pull/N.diff, without the changes made
+  to the base branch since, and that it fails for an unknown target.
+
+usage: test_git_diff_patch.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+
+# pylint: disable=wrong-import-position
+import github_checkpatch
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+    'GIT_CONFIG_NOSYSTEM': '1', 'HOME': os.devnull,
+}
+
+
+class GitDiffPatchTest(unittest.TestCase):
+    """git_diff_patch() against a repository made for each test"""
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp(prefix='git_diff_patch')
+        self.git('init', '--quiet')
+        self.git('symbolic-ref', 'HEAD', 'refs/heads/base')
+        self.write('hello.py', 'print("hello")\n')
+        self.commit('base')
+        self.git('checkout', '--quiet', '-b', 'feature')
+        self.write('hello.py', 'print("hello, world")\n')
+        self.write('new.sh', '#!/bin/sh\necho new\n')
+        self.feature = self.commit('feature')
+        self.git('checkout', '--quiet', 'base')
+        self.write('later.txt', 'landed after the fork\n')
+        self.commit('later')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def git(self, *args):
+        """The output of git args in self.repo"""
+        return subprocess.check_output(
+            ('git',) + args, cwd=self.repo,
+            env=dict(os.environ, **GIT_ENV)).decode('utf-8').strip()
+
+    def write(self, path, text):
+        """_"""
+        with open(os.path.join(self.repo, path), 'w',
+                  encoding='utf-8') as out:
+            out.write(text)
+
+    def commit(self, message):
+        """Commit everything in the working tree and return its SHA"""
+        self.git('add', '--all')
+        self.git('commit', '--quiet', '-m', message)
+        return self.git('rev-parse', 'HEAD')
+
+    def test_diff_from_merge_base(self):
+        """Only what the feature branch changed is in the patch"""
+        patch = github_checkpatch.git_diff_patch('base', self.feature,
+                                                 self.repo)
+        self.assertIsInstance(patch, bytes)
+        text = patch.decode('utf-8')
+        self.assertIn('diff --git a/hello.py b/hello.py\n', text)
+        self.assertIn('-print("hello")\n+print("hello, world")\n', text)
+        self.assertIn('diff --git a/new.sh b/new.sh\n', text)
+        self.assertIn('+echo new\n', text)
+        self.assertNotIn('later.txt', text)
+
+    def test_prefers_origin(self):
+        """The base branch as fetched from origin is diffed against"""
+        self.git('update-ref', 'refs/remotes/origin/base', self.feature)
+        self.assertEqual(github_checkpatch.git_diff_patch(
+            'base', self.feature, self.repo), b'')
+
+    def test_unknown_target(self):
+        """_"""
+        with self.assertRaises(subprocess.CalledProcessError):
+            github_checkpatch.git_diff_patch('no-such-branch', self.feature,
+                                             self.repo)
+
+
+if __name__ == '__main__':
+    unittest.main()
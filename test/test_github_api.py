@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+"""
+GitHub Client Test
+~~~~~~ ~~~~~~ ~~~~
+
+* Check that GithubClient makes GETs conditional on the ETag it has
+  cached and answers a 304 from the cache, including from a cache saved
+  by an earlier run.
+* Check that commits, fetched by SHA, are never cached, and that the
+  cache keeps only the most recently used entries when it is saved.
+
+usage: test_github_api.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+
+# pylint: disable=wrong-import-position
+import github_api
+import github_stub
+
+PULL = '/repos/daos-stack/code_review/pulls/1'
+COMMIT = '/repos/daos-stack/code_review/commits/' + 'f' * 40
+
+
+class GithubClientTest(unittest.TestCase):
+    """GithubClient against a GithubStub"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='github_api')
+        self.cache_path = os.path.join(self.tmp_dir, 'github_etags.json')
+        self.stub = github_stub.GithubStub()
+        self.stub.route('GET', PULL, {'number': 1, 'title': 'first'},
+                        etag='"pull-1"')
+        self.stub.route('GET', COMMIT, {'sha': 'f' * 40}, etag='"commit"')
+        self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def client(self):
+        """A GithubClient for the stub, with the ETag cache in cache_path"""
+        return github_api.GithubClient(
+            github_api.connect('user', 'password', self.stub.url),
+            github_api.ETagCache(self.cache_path))
+
+    def test_not_modified(self):
+        """A repeated GET is answered by a 304 and the cached data"""
+        client = self.client()
+        _, first = client.get(PULL)
+        _, second = client.get(PULL)
+        self.assertEqual(first, {'number': 1, 'title': 'first'})
+        self.assertEqual(second, first)
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(client.not_modified, 1)
+        self.assertEqual([(method, path, etag)
+                          for method, path, etag, _ in self.stub.requests],
+                         [('GET', PULL, None), ('GET', PULL, '"pull-1"')])
+
+    def test_saved_cache(self):
+        """The ETags of one run make the GETs of the next conditional"""
+        client = self.client()
+        client.get(PULL)
+        client.close()
+        client = self.client()
+        _, data = client.get(PULL)
+        self.assertEqual(data, {'number': 1, 'title': 'first'})
+        self.assertEqual(client.not_modified, 1)
+
+    def test_modified(self):
+        """New data under a new ETag replaces what was cached"""
+        client = self.client()
+        client.get(PULL)
+        self.stub.route('GET', PULL, {'number': 1, 'title': 'second'},
+                        etag='"pull-2"')
+        _, data = client.get(PULL)
+        self.assertEqual(data, {'number': 1, 'title': 'second'})
+        self.assertEqual(client.not_modified, 0)
+        self.assertEqual(client.cache.get(PULL)['etag'], '"pull-2"')
+
+    def test_commit_not_cached(self):
+        """Commits are always fetched in full and never stored"""
+        client = self.client()
+        client.get_commit('daos-stack', 'code_review', 'f' * 40)
+        client.get_commit('daos-stack', 'code_review', 'f' * 40)
+        self.assertEqual(client.not_modified, 0)
+        self.assertEqual([etag for _, _, etag, _ in self.stub.requests],
+                         [None, None])
+        self.assertIsNone(client.cache.get(COMMIT))
+
+    def test_cache_bound(self):
+        """Only the max_entries most recently used entries are saved"""
+        cache = github_api.ETagCache(self.cache_path, max_entries=2)
+        for url in ('/a', '/b', '/c'):
+            cache.put(url, '"%s"' % url, None)
+        cache.get('/a')
+        cache.save()
+        self.assertEqual(sorted(github_api.ETagCache(self.cache_path).entries),
+                         ['/a', '/c'])
+
+
+if __name__ == '__main__':
+    unittest.main()